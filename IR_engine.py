@@ -5,26 +5,74 @@ OPTIONS:
     -h : print this help message
     -s : use "with stoplist" configuration (default: without)
     -p : use "with stemming" configuration (default: without)
-    -w LABEL : use weighting scheme "LABEL" (LABEL in {binary, tf, tfidf}, default: binary)
-    -o FILE : output results to file FILE
+    -w LABEL : use weighting scheme "LABEL" (LABEL in {binary, tf, tfidf, logtfidf, maxtf, bm25}
+               or any other scheme registered in weighting.py, default: binary)
+    -e LABEL : use scoring engine "LABEL" (LABEL in {doc, taat, maxscore}, default: doc)
+    -k INT : retrieve the INT best documents for each query (default: 10)
+    -z : hold the doc ids of the term postings the engines walk as compressed
+         blocks, decoded as each query term is read
+    -b : score all queries at once with sparse matrix products (batch mode)
+    -d FILE : read the index and queries from FILE, either the original
+              pickle or a container written by ir_data.py (default: IR_data.pickle)
+    -j INT : score queries on INT processes sharing the index in shared memory (implies -b)
+    -c DIR : cache precomputed weights in DIR and reuse them (implies -b)
+    -l INT : score queries against a rank INT latent semantic index built by
+             truncated SVD of the document weights (implies -b; stored with
+             the weights cache when -c is given)
+    -x INT : with -l, re-rank the INT best latent candidates by exact cosine
+    -n INT : split the collection into INT document shards, each served by its
+             own process, and merge their top k lists (implies -b, ignores -c)
+    -i : time the stages of each query and print histograms (not in batch mode)
+    -f INT : expand each query by Rocchio pseudo-relevance feedback from its
+             INT best documents and retrieve again (not in batch mode)
+    -g INT : with -f, add up to INT expansion terms to each query (default: 40)
+    -u FLOAT : with -f, spend at most FLOAT milliseconds on a query, dropping
+               expansion terms (or the feedback) that would not fit
+    -a INT : answer queries from champion lists of the INT best postings of
+             each term, falling back on the full postings lists when they
+             hold fewer than k documents (not in batch mode, nor with -f;
+             see tiers.py for the latency / precision report)
+    -r INT : keep the results of up to INT distinct queries in an LRU cache
+    -q FILE : stream preprocessed queries from FILE ("-" for standard input),
+              one "QID term term ..." line per query, writing results as each
+              chunk of queries is scored (implies -b; the queries of the data
+              file are not used)
+    -m INT : score INT streamed queries per chunk (default: 256)
+    -t : write streamed results in TREC format "QID Q0 DOCID RANK SCORE TAG"
+    -o FILE : output results to file FILE ("-" for standard output, the
+              default when streaming)
 ------------------------------------------------------------\
 """
 
 #==============================================================================
 # Importing
 
+import os
 import sys
 import getopt
-import pickle
+
+import ir_data
 
 from my_retriever import Retrieve
+from sparse_index import Sparse_Index
+from parallel_query import for_queries_parallel
+from weights_cache import Weights_Cache
+from query_cache import Query_Cache
+from instrumentation import Query_Profile
+from feedback import Rocchio_Feedback
+from tiers import Tiered_Index
+from weighting import SCHEMES
+from lsi import Latent_Index
+from sharded import Sharded_Index
+
+DATA_FILE = 'IR_data.pickle'
 
 #==============================================================================
 # Command line processing
 
 class CommandLine:
     def __init__(self):
-        opts, args = getopt.getopt(sys.argv[1:], 'hspw:o:')
+        opts, args = getopt.getopt(sys.argv[1:], 'hspbzitw:e:k:j:d:c:r:q:m:l:x:n:f:g:u:a:o:')
         opts = dict(opts)
         self.exit = True
 
@@ -38,46 +86,207 @@ class CommandLine:
             return
 
         if '-w' in opts:
-            if opts['-w'] in ('binary', 'tf', 'tfidf'):
+            if opts['-w'] in SCHEMES:
                 self.term_weighting = opts['-w']
             else:
                 warning = (
                     "*** ERROR: term weighting label (opt: -w LABEL)! ***\n"
                     "    -- value (%s) not recognised!\n"
-                    "    -- must be one of: binary / tf / tfidf"
-                    )  % (opts['-w'])
+                    "    -- must be one of: %s"
+                    )  % (opts['-w'], ' / '.join(SCHEMES))
                 print(warning, file=sys.stderr)
                 self.print_help()
                 return
         else:
             self.term_weighting = 'binary'
 
+        if '-e' in opts:
+            if opts['-e'] in Retrieve.ENGINES:
+                self.engine = opts['-e']
+            else:
+                warning = (
+                    "*** ERROR: scoring engine label (opt: -e LABEL)! ***\n"
+                    "    -- value (%s) not recognised!\n"
+                    "    -- must be one of: %s"
+                    )  % (opts['-e'], ' / '.join(Retrieve.ENGINES))
+                print(warning, file=sys.stderr)
+                self.print_help()
+                return
+        else:
+            self.engine = 'doc'
+
+        if '-k' in opts:
+            if opts['-k'].isdigit() and int(opts['-k']) > 0:
+                self.k = int(opts['-k'])
+            else:
+                print("*** ERROR: number of results (opt: -k INT) must be a positive integer! ***",
+                      file=sys.stderr)
+                self.print_help()
+                return
+        else:
+            self.k = 10
+
+        self.stream = opts.get('-q')
+        if self.stream != None and '-n' in opts:
+            print("*** ERROR: streamed queries (opt: -q FILE) cannot be scored on shards (opt: -n INT)! ***",
+                  file=sys.stderr)
+            self.print_help()
+            return
+        self.trec = '-t' in opts
+        if '-m' in opts:
+            if opts['-m'].isdigit() and int(opts['-m']) > 0:
+                self.chunk_size = int(opts['-m'])
+            else:
+                print("*** ERROR: chunk size (opt: -m INT) must be a positive integer! ***",
+                      file=sys.stderr)
+                self.print_help()
+                return
+        else:
+            self.chunk_size = Sparse_Index.CHUNK_SIZE
+
         if '-o' in opts:
             self.outfile = opts['-o']
+        elif self.stream != None:
+            self.outfile = '-'
         else:
             print("*** ERROR: must specify output file (opt: -o FILE) ***",
                   file=sys.stderr)
             self.print_help()
             return
 
+        if '-j' in opts:
+            if opts['-j'].isdigit() and int(opts['-j']) > 0:
+                self.processes = int(opts['-j'])
+            else:
+                print("*** ERROR: number of processes (opt: -j INT) must be a positive integer! ***",
+                      file=sys.stderr)
+                self.print_help()
+                return
+        else:
+            self.processes = None
+
+        if '-r' in opts:
+            if opts['-r'].isdigit() and int(opts['-r']) > 0:
+                self.result_cache = int(opts['-r'])
+            else:
+                print("*** ERROR: result cache size (opt: -r INT) must be a positive integer! ***",
+                      file=sys.stderr)
+                self.print_help()
+                return
+        else:
+            self.result_cache = None
+
+        if '-l' in opts:
+            if opts['-l'].isdigit() and int(opts['-l']) > 0:
+                self.lsi_rank = int(opts['-l'])
+            else:
+                print("*** ERROR: latent index rank (opt: -l INT) must be a positive integer! ***",
+                      file=sys.stderr)
+                self.print_help()
+                return
+        else:
+            self.lsi_rank = None
+
+        if '-x' in opts:
+            if opts['-x'].isdigit() and int(opts['-x']) > 0:
+                self.rerank = int(opts['-x'])
+            else:
+                print("*** ERROR: number of candidates to re-rank (opt: -x INT) must be a positive integer! ***",
+                      file=sys.stderr)
+                self.print_help()
+                return
+        else:
+            self.rerank = None
+
+        if '-f' in opts:
+            if opts['-f'].isdigit() and int(opts['-f']) > 0:
+                self.feedback_docs = int(opts['-f'])
+            else:
+                print("*** ERROR: number of feedback documents (opt: -f INT) must be a positive integer! ***",
+                      file=sys.stderr)
+                self.print_help()
+                return
+        else:
+            self.feedback_docs = None
+
+        if '-g' in opts:
+            if opts['-g'].isdigit():
+                self.expansion_terms = int(opts['-g'])
+            else:
+                print("*** ERROR: number of expansion terms (opt: -g INT) must be a non-negative integer! ***",
+                      file=sys.stderr)
+                self.print_help()
+                return
+        else:
+            self.expansion_terms = 40
+
+        if '-u' in opts:
+            try:
+                self.budget = float(opts['-u']) / 1000
+            except ValueError:
+                self.budget = -1
+            if self.budget <= 0:
+                print("*** ERROR: latency budget (opt: -u FLOAT) must be a positive number of milliseconds! ***",
+                      file=sys.stderr)
+                self.print_help()
+                return
+        else:
+            self.budget = None
+
+        if '-a' in opts:
+            if opts['-a'].isdigit() and int(opts['-a']) > 0 and self.feedback_docs == None:
+                self.champions = int(opts['-a'])
+            else:
+                print("*** ERROR: champion list size (opt: -a INT) must be a positive integer, without -f! ***",
+                      file=sys.stderr)
+                self.print_help()
+                return
+        else:
+            self.champions = None
+
+        if '-n' in opts:
+            if opts['-n'].isdigit() and int(opts['-n']) > 0:
+                self.shards = int(opts['-n'])
+            else:
+                print("*** ERROR: number of shards (opt: -n INT) must be a positive integer! ***",
+                      file=sys.stderr)
+                self.print_help()
+                return
+        else:
+            self.shards = None
+
+        self.instrument = '-i' in opts
+        self.batch = '-b' in opts or '-c' in opts or '-j' in opts or '-q' in opts or '-l' in opts
+
         if '-s' in opts:
-            stoplist = 'yes'
+            self.stoplist = 'yes'
         else:
-            stoplist = 'no'
+            self.stoplist = 'no'
         
         if '-p' in opts:
-            stemming = 'yes'
+            self.stemming = 'yes'
         else:
-            stemming = 'no'
+            self.stemming = 'no'
 
-        with open('IR_data.pickle', 'rb') as data_in:
-            all_data = pickle.load(data_in)
+        if '-d' in opts:
+            self.data_file = opts['-d']
+        else:
+            self.data_file = DATA_FILE
 
-        choice = 'index_stoplist_%s_stemming_%s' % (stoplist, stemming)
-        self.index = all_data[choice]
-            
-        choice = 'queries_stoplist_%s_stemming_%s' % (stoplist, stemming)
-        self.queries = all_data[choice]
+        # a cache hit provides the derived arrays and the queries, so
+        # the data file is not loaded at all
+        self.sparse_index = None
+        if '-c' in opts and self.shards == None: # shards are built from the index
+            self.cache = Weights_Cache(opts['-c'], self.data_file)
+            cached = self.cache.load(self.stoplist, self.stemming, self.term_weighting)
+            if cached != None:
+                self.sparse_index, self.queries = cached
+        else:
+            self.cache = None
+
+        if self.sparse_index == None:
+            self.index, self.queries = ir_data.load(self.data_file, self.stoplist, self.stemming)
+        self.compressed = '-z' in opts
             
         self.exit = False
 
@@ -91,19 +300,63 @@ class CommandLine:
 # Store for Retrieval Results
 
 class Result_Store:
-    def __init__(self):
+    def __init__(self, k=10):
+        self.k = k
         self.results = []
 
     def store(self, qid, docids):
-        if len(docids) > 10:
-            docids = docids[:10]
+        if len(docids) > self.k:
+            docids = docids[:self.k]
         self.results.append((qid, docids))
 
     def output(self, outfile):
-        with open(outfile, 'w') as out:
-            for (qid, docids) in self.results:
-                for docid in docids:
-                    print(qid, docid, file=out)
+        if outfile == '-':
+            try:
+                self.write(sys.stdout)
+                sys.stdout.flush()
+            except BrokenPipeError: # the consumer stopped reading
+                os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        else:
+            with open(outfile, 'w') as out:
+                self.write(out)
+
+    def write(self, out):
+        for (qid, docids) in self.results:
+            for docid in docids:
+                print(qid, docid, file=out)
+
+#==============================================================================
+# Streaming
+
+# Read (qid, terms) pairs from lines of "QID term term ..."
+def read_queries(lines):
+    for line in lines:
+        fields = line.split()
+        if fields:
+            yield int(fields[0]), fields[1:]
+
+# Score queries read from lines in chunks of chunk_size and write the
+# results of each chunk as soon as it is scored, as "QID DOCID" lines
+# or TREC lines with cosines. Only one chunk is held at a time.
+def stream_queries(sparse_index, lines, out, k=10, chunk_size=256, trec=False):
+    chunk = []
+    for query in read_queries(lines):
+        chunk.append(query)
+        if len(chunk) == chunk_size:
+            write_chunk(sparse_index, chunk, out, k, trec)
+            chunk = []
+    if chunk:
+        write_chunk(sparse_index, chunk, out, k, trec)
+
+def write_chunk(sparse_index, chunk, out, k, trec):
+    results = sparse_index.for_queries_scored([query for (qid, query) in chunk], k)
+    for ((qid, query), (docids, cosines)) in zip(chunk, results):
+        for rank, (docid, cosine) in enumerate(zip(docids, cosines), 1):
+            if trec:
+                print(qid, 'Q0', docid, rank, '%.6f' % cosine, sparse_index.term_weighting, file=out)
+            else:
+                print(qid, docid, file=out)
+    out.flush()
 
 #==============================================================================
 # MAIN
@@ -114,12 +367,95 @@ if __name__ == '__main__':
     if config.exit:
         sys.exit(0)
     queries = config.queries
-    retrieve = Retrieve(config.index, config.term_weighting)
-    all_results = Result_Store()
+    all_results = Result_Store(config.k)
     # print(config.index)
 
-    for (qid, query) in queries:
-        results = retrieve.for_query(query)
-        all_results.store(qid, results)
+    if config.shards != None:
+        with Sharded_Index(config.index, config.term_weighting, config.shards) as sharded_index:
+            batch_results = sharded_index.for_queries([query for (qid, query) in queries], config.k)
+        for ((qid, query), results) in zip(queries, batch_results):
+            all_results.store(qid, results)
+        all_results.output(config.outfile)
+        sys.exit(0)
+
+    if config.sparse_index != None:
+        sparse_index = config.sparse_index
+    else:
+        retrieve = Retrieve(config.index, config.term_weighting, config.engine, config.compressed)
+        if config.batch:
+            sparse_index = Sparse_Index(retrieve)
+        if config.cache != None:
+            config.cache.store(config.stoplist, config.stemming, config.term_weighting,
+                               sparse_index, queries)
+
+    if config.stream != None:
+        lines = sys.stdin if config.stream == '-' else open(config.stream)
+        out = sys.stdout if config.outfile == '-' else open(config.outfile, 'w')
+        try:
+            stream_queries(sparse_index, lines, out, config.k, config.chunk_size, config.trec)
+        except BrokenPipeError: # the consumer stopped reading
+            os.dup2(os.open(os.devnull, os.O_WRONLY), out.fileno())
+        finally:
+            if lines is not sys.stdin:
+                lines.close()
+            if out is not sys.stdout:
+                out.close()
+        sys.exit(0)
+
+    if config.lsi_rank != None:
+        latent_index = None
+        if config.cache != None:
+            lsi_path = '%s_lsi_%d' % (config.cache.entry_path(config.stoplist, config.stemming,
+                                                              config.term_weighting), config.lsi_rank)
+            if os.path.exists(lsi_path):
+                latent_index = Latent_Index.load(sparse_index, lsi_path)
+        if latent_index == None:
+            latent_index = Latent_Index(sparse_index, config.lsi_rank)
+            if config.cache != None:
+                latent_index.save(lsi_path)
+        batch_results = latent_index.for_queries([query for (qid, query) in queries], config.k, config.rerank)
+        for ((qid, query), results) in zip(queries, batch_results):
+            all_results.store(qid, results)
+    elif config.processes != None:
+        for (qid, results) in for_queries_parallel(sparse_index, queries, config.k, config.processes):
+            all_results.store(qid, results)
+    elif config.batch:
+        batch_results = sparse_index.for_queries([query for (qid, query) in queries], config.k)
+        for ((qid, query), results) in zip(queries, batch_results):
+            all_results.store(qid, results)
+    else:
+        retriever = retrieve
+        profile = Query_Profile() if config.instrument else None
+        if config.feedback_docs != None:
+            feedback = retriever = Rocchio_Feedback(retrieve, config.feedback_docs, config.expansion_terms,
+                                                    budget=config.budget, profile=profile)
+        elif config.champions != None:
+            tiered_index = retriever = Tiered_Index(retrieve, config.champions, profile)
+        else:
+            retrieve.profile = profile
+        if config.result_cache != None:
+            retriever = Query_Cache(retriever, (config.stoplist, config.stemming), config.result_cache)
+        for (qid, query) in queries:
+            results = retriever.for_query(query, config.k)
+            all_results.store(qid, results)
+        if config.instrument:
+            profile.dump()
+        if config.feedback_docs != None:
+            stats = feedback.stats
+            print("Feedback: %d queries expanded, %d trimmed and %d skipped to fit the budget"
+                  % (stats['expanded'], stats['trimmed'], stats['skipped']), file=sys.stderr)
+        if config.champions != None:
+            stats = tiered_index.stats
+            print("Champion lists: %d queries answered from the first tier, %d from the full lists"
+                  % (stats['first_tier'], stats['fallback']), file=sys.stderr)
+        if config.result_cache != None:
+            stats = retriever.stats
+            print("Result cache: %d hits, %d misses, %d evictions" % (stats['hits'], stats['misses'], stats['evictions']),
+                  file=sys.stderr)
+
+    if config.sparse_index == None and config.engine == 'maxscore' and not config.batch:
+        stats = retrieve.sparse_index.pruning_stats
+        print("MaxScore: %d postings scored, %d skipped" % (stats['scored'], stats['skipped']),
+              file=sys.stderr)
 
     all_results.output(config.outfile)
\ No newline at end of file
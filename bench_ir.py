@@ -0,0 +1,203 @@
+"""\
+------------------------------------------------------------
+USE: python <PROGNAME> (options)
+ACTION: times index loading, Retrieve construction and query
+    latency for every stoplist / stemming configuration,
+    weighting scheme and scorer, over the queries of the data
+    file (those of queries.txt), and writes the timings as JSON
+OPTIONS:
+    -h : print this help message
+    -d FILE : read the index and queries from FILE (default: IR_data.pickle)
+    -k INT : retrieve the INT best documents for each query (default: 10)
+    -r INT : run the query set INT times per scorer (default: 5)
+    -S LIST : only run the comma separated scorers in LIST
+              (default: doc,taat,maxscore,batch,rocchio,log,max)
+    -w LIST : only use the comma separated weighting schemes in LIST
+              (default: every scheme registered in weighting.py)
+    -b FILE : compare the median latency and throughput of the fastest run
+              with those of the baseline timings in FILE and exit with status 1 if any of
+              them regressed
+    -t FLOAT : relative slowdown counted as a regression (default: 0.2)
+    -f FLOAT : ignore slowdowns of less than FLOAT milliseconds per query
+               (default: 0.05)
+    -o FILE : write the timings to FILE (default: standard output)
+------------------------------------------------------------\
+"""
+
+import getopt
+import json
+import sys
+import time
+import numpy as np
+
+import ir_data
+import my_retriever
+import my_retriever_log
+import my_retriver_max
+from sparse_index import Sparse_Index
+from feedback import Rocchio_Feedback
+from weighting import SCHEMES as WEIGHTING_SCHEMES
+
+DATA_FILE = 'IR_data.pickle'
+
+CONFIGS = [(stoplist, stemming) for stemming in ('no', 'yes') for stoplist in ('no', 'yes')]
+SCHEMES = tuple(WEIGHTING_SCHEMES)
+
+# Scorers: the engines of my_retriever, its batch mode, Rocchio feedback
+# over its doc engine, and the two forks (log tf and max tf weighting),
+# which always return the 10 best and only know the binary, tf and
+# tfidf schemes
+SCORERS = ('doc', 'taat', 'maxscore', 'batch', 'rocchio', 'log', 'max')
+FORKS = ('log', 'max')
+FORK_SCHEMES = ('binary', 'tf', 'tfidf')
+
+# Timings where a higher value is worse; throughput is the other way
+TIMINGS = ('load', 'init', 'p50', 'p95', 'p99')
+
+# Timings compared with a baseline. Load and init are single samples and
+# the tail percentiles rest on a handful of queries, so they are too
+# noisy to gate on; p50 and throughput are the best over the repeats.
+GATED = ('p50', 'throughput')
+
+# Build the scorer and return (seconds spent, function running a list
+# of queries and returning the time taken by each, or None in batch mode)
+def build_scorer(scorer, index, term_weighting, k):
+    start = time.perf_counter()
+    if scorer == 'batch':
+        sparse_index = Sparse_Index(my_retriever.Retrieve(index, term_weighting))
+        def run(queries):
+            sparse_index.for_queries(queries, k)
+            return None
+    else:
+        if scorer == 'log':
+            retrieve = my_retriever_log.Retrieve(index, term_weighting)
+            for_query = retrieve.for_query
+        elif scorer == 'max':
+            retrieve = my_retriver_max.Retrieve(index, term_weighting)
+            for_query = retrieve.for_query
+        elif scorer == 'rocchio':
+            feedback = Rocchio_Feedback(my_retriever.Retrieve(index, term_weighting))
+            for_query = lambda query: feedback.for_query(query, k)
+        else:
+            retrieve = my_retriever.Retrieve(index, term_weighting, scorer)
+            for_query = lambda query: retrieve.for_query(query, k)
+        def run(queries):
+            latencies = []
+            for query in queries:
+                query_start = time.perf_counter()
+                for_query(query)
+                latencies.append(time.perf_counter() - query_start)
+            return latencies
+    return time.perf_counter() - start, run
+
+# Time one scorer on one configuration and scheme. Latencies are in
+# milliseconds, throughput in queries per second. p50 and throughput are
+# those of the fastest run of the query set, the least disturbed by the
+# rest of the machine; p95 and p99 are over the latencies of all runs.
+def bench_scorer(scorer, index, queries, term_weighting, k, repeats):
+    init, run = build_scorer(scorer, index, term_weighting, k)
+    latencies = []
+    run_p50s = []
+    run_throughputs = []
+    for repeat in range(repeats):
+        start = time.perf_counter()
+        run_latencies = run(queries)
+        run_throughputs.append(len(queries) / (time.perf_counter() - start))
+        if run_latencies != None:
+            latencies.extend(run_latencies)
+            run_p50s.append(np.percentile(run_latencies, 50) * 1000)
+    timings = {'init': init, 'throughput': max(run_throughputs)}
+    if latencies:
+        p95, p99 = np.percentile(np.array(latencies) * 1000, [95, 99])
+        timings.update(p50=min(run_p50s), p95=p95, p99=p99)
+    return timings
+
+def bench(data_file, scorers, schemes, k=10, repeats=5):
+    results = {}
+    for (stoplist, stemming) in CONFIGS:
+        start = time.perf_counter()
+        index, queries = ir_data.load(data_file, stoplist, stemming)
+        load = time.perf_counter() - start
+        queries = [query for (qid, query) in queries]
+        for term_weighting in schemes:
+            for scorer in scorers:
+                if scorer in FORKS and term_weighting not in FORK_SCHEMES:
+                    continue
+                timings = bench_scorer(scorer, index, queries, term_weighting, k, repeats)
+                timings['load'] = load
+                key = 'stoplist_%s_stemming_%s/%s/%s' % (stoplist, stemming, term_weighting, scorer)
+                results[key] = timings
+                p50 = '%8.3fms' % timings['p50'] if 'p50' in timings else '%10s' % '-'
+                print('%-41s init %7.3fs  p50 %s  %8.1f q/s' % (key, timings['init'], p50, timings['throughput']),
+                      file=sys.stderr)
+    return {'data_file': data_file, 'k': k, 'repeats': repeats, 'queries': len(queries),
+            'results': results}
+
+# Compare the GATED timings with a baseline. Returns a list of
+# (key, measure, baseline, current, relative change) for every measure
+# that got worse by more than threshold and by at least noise_floor
+# milliseconds per query (for throughput, in the time per query).
+def regressions(current, baseline, threshold=0.2, noise_floor=0.05):
+    found = []
+    for key, timings in current['results'].items():
+        old = baseline['results'].get(key)
+        if old == None:
+            continue
+        for measure in GATED:
+            if measure not in timings or old.get(measure, 0) <= 0 or timings[measure] <= 0:
+                continue
+            value = timings[measure]
+            change = (value - old[measure]) / old[measure]
+            slowdown = value - old[measure]
+            if measure == 'throughput':
+                change = -change
+                slowdown = 1000 / value - 1000 / old[measure]
+            if change > threshold and slowdown >= noise_floor:
+                found.append((key, measure, old[measure], value, change))
+    return found
+
+#==============================================================================
+# Command line processing
+
+def print_help():
+    progname = sys.argv[0]
+    progname = progname.split('/')[-1] # strip off extended path
+    help = __doc__.replace('<PROGNAME>', progname, 1)
+    print(help, file=sys.stderr)
+
+if __name__ == '__main__':
+    opts, args = getopt.getopt(sys.argv[1:], 'hd:k:r:S:w:b:t:f:o:')
+    opts = dict(opts)
+
+    if '-h' in opts or len(args) > 0:
+        print_help()
+        sys.exit(0)
+
+    scorers = opts['-S'].split(',') if '-S' in opts else SCORERS
+    schemes = opts['-w'].split(',') if '-w' in opts else SCHEMES
+    unknown = [label for label in scorers if label not in SCORERS] + [
+              label for label in schemes if label not in SCHEMES]
+    if unknown:
+        print("*** ERROR: unknown scorer or weighting scheme: %s ***" % ', '.join(unknown), file=sys.stderr)
+        print_help()
+        sys.exit(0)
+
+    report = bench(opts.get('-d', DATA_FILE), scorers, schemes,
+                   int(opts.get('-k', 10)), int(opts.get('-r', 5)))
+
+    if '-o' in opts:
+        with open(opts['-o'], 'w') as out:
+            json.dump(report, out, indent=1, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=1, sort_keys=True)
+        print()
+
+    if '-b' in opts:
+        with open(opts['-b']) as baseline_file:
+            baseline = json.load(baseline_file)
+        found = regressions(report, baseline, float(opts.get('-t', 0.2)), float(opts.get('-f', 0.05)))
+        for (key, measure, old, new, change) in found:
+            print('REGRESSION %s %s: %.4g -> %.4g (%+.0f%%)' % (key, measure, old, new, 100 * change),
+                  file=sys.stderr)
+        if found:
+            sys.exit(1)
@@ -0,0 +1,91 @@
+import numpy as np
+
+from forward_index import row_offsets
+
+# Varint encoding of an array of non-negative integers: 7 bits per byte,
+# low bits first, high bit set on every byte but the last. Returns the
+# bytes as a uint8 array and the number of bytes of each value.
+def encode_varints(values):
+    values = np.asarray(values, dtype=np.int64)
+    sizes = np.ones(len(values), dtype=np.int64)
+    rest = values >> 7
+    while rest.any():
+        sizes += rest > 0
+        rest >>= 7
+    owners = np.repeat(np.arange(len(values)), sizes)
+    shifts = 7 * (np.arange(int(sizes.sum())) - np.repeat(np.cumsum(sizes) - sizes, sizes))
+    data = ((values[owners] >> shifts) & 0x7f) | np.where(shifts < 7 * (sizes[owners] - 1), 0x80, 0)
+    return data.astype(np.uint8), sizes
+
+# Decode a run of varints held in a uint8 NumPy array
+def decode_varints(data):
+    if len(data) == 0:
+        return np.zeros(0, dtype=np.int64)
+    ends = data < 0x80
+    starts = np.flatnonzero(np.concatenate(([True], ends[:-1])))
+    shifts = 7 * (np.arange(len(data)) - np.repeat(starts, np.diff(np.append(starts, len(data)))))
+    return np.add.reduceat((data & 0x7f).astype(np.int64) << shifts, starts)
+
+# An array of non-negative integers as int32 if it fits, else int64
+def compact(values):
+    return values.astype(np.int32 if len(values) == 0 or values.max() < 1 << 31 else np.int64)
+
+# Term-major postings (see forward_index.Term_Postings) with compressed
+# doc ids. The dense doc ids of each term are cut into blocks of
+# BLOCK_SIZE postings; a skip table holds the first doc id and the byte
+# offset of every block, as int32 where they fit, and the
+# other doc ids are varint-encoded gaps in one byte array. The weights
+# stay in a parallel array. The postings of the query terms are
+# decoded, in one vectorised pass, every time they are read.
+class Compressed_Postings:
+
+    BLOCK_SIZE = 128
+
+    def __init__(self, indptr, docs, data):
+        self.indptr = indptr
+        self.data = data
+        lengths = np.diff(indptr)
+        term_blocks = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(-(-lengths // self.BLOCK_SIZE), out=term_blocks[1:])
+        self.term_blocks = compact(term_blocks)
+        ranks = np.arange(len(docs)) - np.repeat(indptr[:-1], lengths) # position in the term's list
+        is_first = ranks % self.BLOCK_SIZE == 0
+        firsts = np.flatnonzero(is_first)
+        self.block_first_docs = compact(docs[firsts])
+        others = np.flatnonzero(~is_first)
+        self.doc_bytes, sizes = encode_varints(docs[others].astype(np.int64) - docs[others - 1])
+        gap_ends = np.concatenate(([0], np.cumsum(sizes)))
+        # the gaps before a block are its postings before it, minus the first ones
+        block_starts = np.append(firsts, len(docs))
+        self.block_offsets = compact(gap_ends[block_starts - np.arange(len(block_starts))])
+
+    # Documents and weights of some terms, term after term, and the
+    # number of postings of each. Only the blocks of these terms are
+    # decoded: the gaps are read from the byte array, the first doc id
+    # of each block from the skip table, and summed within each block.
+    def gather(self, term_ids):
+        blocks, block_counts = row_offsets(self.term_blocks, term_ids)
+        byte_offsets, byte_counts = row_offsets(self.block_offsets, blocks)
+        offsets, counts = row_offsets(self.indptr, term_ids)
+        owners = np.repeat(term_ids, block_counts)
+        starts = self.indptr[owners] + self.BLOCK_SIZE * (blocks - self.term_blocks[owners])
+        sizes = np.minimum(self.indptr[owners + 1] - starts, self.BLOCK_SIZE)
+        firsts = np.cumsum(sizes) - sizes
+        is_first = np.zeros(len(offsets), dtype=bool)
+        is_first[firsts] = True
+        values = np.empty(len(offsets), dtype=np.int64)
+        values[firsts] = self.block_first_docs[blocks]
+        values[~is_first] = decode_varints(self.doc_bytes[byte_offsets])
+        totals = np.cumsum(values)
+        docs = totals - np.repeat(totals[firsts] - values[firsts], sizes)
+        return docs, self.data[offsets], counts
+
+    # Row pointers, doc ids and weights of every term, decompressed
+    def arrays(self):
+        docs, data, counts = self.gather(np.arange(len(self.indptr) - 1))
+        return self.indptr, docs.astype(np.int32), data
+
+    # Bytes held by the doc ids: doc bytes and skip table
+    def docs_bytes(self):
+        return sum(array.nbytes for array in (self.doc_bytes, self.term_blocks, self.block_first_docs,
+                                              self.block_offsets))
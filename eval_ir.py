@@ -1,6 +1,7 @@
 """\
 --------------------------------------------------------------------------------
     USE: python <PROGNAME> (options) keyfile response
+         python <PROGNAME> -c LIST (options) keyfile response [response ...]
     ACTION: computes IR system performance measures, given input files:
         * 'keyfile' - a "gold standard" indicating the documents that 
                       are relevant to each query, and 
@@ -14,6 +15,10 @@
         -F : print terse flat summary - shows only P, R, F scores (on single line)
         -I : show interpolated precision scores
         -i INT : use INT recall points for interpolated precision (def=10)
+    CUTOFF MODE:
+        -c LIST : for each response file, print P@k, R@k, F@k, MAP@k and
+                  nDCG@k (and with -I interpolated precision at k) for every
+                  k in the comma separated LIST, e.g. -c 5,10,20,100
     DATAFORMAT:
         In both input files, each line specifies two integers, in the manner:
          QID  DOCID
@@ -28,16 +33,26 @@
 
 import sys, re
 import getopt
+import numpy as np
 
 class CommandLine:
     def __init__(self):
-        opts, args = getopt.getopt(sys.argv[1:],'hn:qfFi:I')
+        opts, args = getopt.getopt(sys.argv[1:],'hn:qfFi:Ic:')
         opts = dict(opts)
 
         if '-h' in opts:
             self.printHelp()
 
-        if len(args) == 2:
+        self.cutoffs = None
+        if '-c' in opts:
+            self.cutoffs = [int(k) for k in opts['-c'].split(',')]
+            if len(args) >= 2:
+                self.keyfile = args[0]
+                self.responsefiles = args[1:]
+            else:
+                print('\n*** ERROR: must specify a key file and at least one response file ***', file=sys.stderr)
+                self.printHelp()
+        elif len(args) == 2:
             self.keyfile = args[0]
             self.responsefile = args[1]
         else:
@@ -73,6 +88,20 @@ class CommandLine:
         print(help, file=sys.stderr)
         sys.exit()
 
+# Settings of an evaluation when eval_ir is imported rather than run
+# from the command line: the attributes CommandLine would set, with the
+# defaults of its options
+class Eval_Config:
+    def __init__(self, keyfile=None, responsefile=None, response_limit=None, interp_points=10):
+        self.keyfile = keyfile
+        self.responsefile = responsefile
+        self.response_limit = response_limit
+        self.interp_points = interp_points
+        self.query_print = False
+        self.print_flat = False
+        self.print_terse_flat = False
+        self.show_interp_prec = False
+
 class Key:
     def __init__(self,config):
         skip = re.compile('^\s*($|#)')
@@ -107,20 +136,31 @@ class Key:
         return set(self.relevant.keys())
      
 class Response:
-    def __init__(self,config,key):
-        seen = {}
-        self.retrieved = {}
-        self.rel_ranks = {}
+    # results: (qid, docids) pairs held in memory, e.g. from
+    # Result_Store of IR_engine.py, read instead of config.responsefile
+    def __init__(self,config,key,results=None):
+        if results != None:
+            self.add_responses(config,key,((qid,docid) for (qid,docids) in results for docid in docids))
+        else:
+            response = open(config.responsefile,'r')
+            self.add_responses(config,key,self.read_responses(response))
+            response.close()
+
+    def read_responses(self,response):
         skip = re.compile('^\s*($|#)')
-        response = open(config.responsefile,'r')
         for line in response:
             if skip.search(line): continue
             vals = line.split()
             if len(vals) != 2:
                 msg = 'ERROR: bad line in key file:<%s>' % line
                 raise Exception(msg)
-            qid = int(vals[0])
-            docid = int(vals[1])
+            yield int(vals[0]), int(vals[1])
+
+    def add_responses(self,config,key,responses):
+        seen = {}
+        self.retrieved = {}
+        self.rel_ranks = {}
+        for (qid,docid) in responses:
             if qid not in seen:
                 seen[qid] = set()
                 self.retrieved[qid] = 0
@@ -133,7 +173,6 @@ class Response:
                 self.rel_ranks[qid].append(self.retrieved[qid])
             # duplicate entries are counted, but only *credited* at first occurrence. 
             seen[qid].add(docid)            
-        response.close()
 
     def getRanks(self,qid):
         if qid in self.rel_ranks:
@@ -202,7 +241,8 @@ class Score:
                "    Rel_Retr:        %4d\n"
         ) % (qid,ret,rel,rel_ret), file=sys.stdout, end='')
     
-    def print_measure1_summary(self,config):
+    # Precision, recall and F-measure across all queries
+    def summary(self):
         if self.total_retrieved > 0:
             precision = float(self.total_relevant_retrieved)/self.total_retrieved
         else: 
@@ -215,6 +255,10 @@ class Score:
             fmeasure = (2 * precision * recall)/(precision + recall)
         else:
             fmeasure = 0.0
+        return precision, recall, fmeasure
+
+    def print_measure1_summary(self,config):
+        precision, recall, fmeasure = self.summary()
         if config.print_terse_flat:
             format = "N:{3} P:{4:.2f} R:{5:.2f} F:{6:.2f}"
         elif config.print_flat:
@@ -265,8 +309,119 @@ class Score:
                     self.global_interpolation_points[i]), file=sys.stdout)
         print(file=sys.stdout)
 
+# Relevance flags of a run by rank: one row per query (those of the key
+# and of the run, in qid order), one column per rank, True where a
+# relevant document is retrieved for the first time. Built once from
+# arrays of qids and docids in response order, so that any number of
+# cutoffs is then evaluated with array operations.
+class Run_Matrix:
+    def __init__(self,key,qids,docids):
+        self.qids = np.array(sorted(key.qids() | set(qids.tolist())), dtype=np.int64)
+        num_queries = len(self.qids)
+        rows = np.searchsorted(self.qids, qids)
+        order = np.argsort(rows, kind='stable')
+        rows = rows[order]
+        docids = docids[order]
+        self.retrieved = np.bincount(rows, minlength=num_queries)
+        ranks = np.arange(len(rows)) - np.searchsorted(rows, rows) # 0 based, within the query
+        key_qids = np.array([qid for qid in key.relevant for docid in key.relevant[qid]], dtype=np.int64)
+        key_docids = np.array([docid for qid in key.relevant for docid in key.relevant[qid]], dtype=np.int64)
+        base = int(max(docids.max(initial=0), key_docids.max(initial=0))) + 1
+        codes = self.qids[rows] * base + docids
+        first = np.zeros(len(codes), dtype=bool)
+        first[np.unique(codes, return_index=True)[1]] = True
+        # duplicate entries are counted, but only *credited* at first occurrence
+        hits = np.isin(codes, key_qids * base + key_docids) & first
+        self.relevance = np.zeros((num_queries, int(self.retrieved.max(initial=0))), dtype=bool)
+        self.relevance[rows, ranks] = hits
+        self.num_relevant = np.array([key.numRelevant(qid) for qid in self.qids.tolist()], dtype=np.int64)
+
+    # Read a response file into a Run_Matrix
+    @classmethod
+    def from_file(cls,key,responsefile):
+        pairs = np.loadtxt(responsefile, dtype=np.int64, comments='#', ndmin=2).reshape(-1, 2)
+        return cls(key, pairs[:, 0], pairs[:, 1])
+
+    # Build a Run_Matrix from (qid, docids) results held in memory
+    @classmethod
+    def from_results(cls,key,results):
+        qids = np.array([qid for (qid,docids) in results for docid in docids], dtype=np.int64)
+        docids = np.array([docid for (qid,docids) in results for docid in docids], dtype=np.int64)
+        return cls(key, qids, docids)
+
+    # Compute the measures at every cutoff in one pass. Precision,
+    # recall and F-measure are totals across queries, as in Score;
+    # MAP, nDCG and interpolated precision are averaged over queries.
+    # Returns a dict of arrays with one entry per cutoff (per cutoff and
+    # recall point for 'interpolated').
+    def measures(self,cutoffs,interp_points=10):
+        cutoffs = np.asarray(cutoffs, dtype=np.int64)
+        num_queries, width = self.relevance.shape
+        relevance = np.concatenate((self.relevance, np.zeros((num_queries, 1), dtype=bool)), axis=1)
+        cols = np.minimum(cutoffs, width) - 1 # -1 picks the zero column
+        positions = np.arange(1, width + 2)
+        rel_counts = np.cumsum(relevance, axis=1)
+        rel_ret = np.where(cutoffs > 0, rel_counts[:, cols], 0)
+        retrieved = np.minimum(self.retrieved[:, None], cutoffs[None, :])
+        total_rel_ret = rel_ret.sum(axis=0)
+        total_retrieved = retrieved.sum(axis=0)
+        total_relevant = self.num_relevant.sum()
+        precision = np.divide(total_rel_ret, total_retrieved, out=np.zeros(len(cutoffs)), where=total_retrieved > 0)
+        recall = total_rel_ret / total_relevant if total_relevant > 0 else np.zeros(len(cutoffs))
+        both = precision + recall
+        fmeasure = np.divide(2 * precision * recall, both, out=np.zeros(len(cutoffs)), where=both > 0)
+
+        has_relevant = self.num_relevant[:, None] > 0
+        precisions = np.where(relevance, rel_counts / positions, 0.0)
+        ap = np.divide(np.where(cutoffs > 0, np.cumsum(precisions, axis=1)[:, cols], 0.0),
+                       self.num_relevant[:, None], out=np.zeros(rel_ret.shape), where=has_relevant)
+
+        gains = np.where(relevance, 1 / np.log2(positions + 1), 0.0)
+        dcg = np.where(cutoffs > 0, np.cumsum(gains, axis=1)[:, cols], 0.0)
+        ideal = np.concatenate(([0.0], np.cumsum(1 / np.log2(np.arange(2, max(cutoffs.max(initial=0), 1) + 2)))))
+        idcg = ideal[np.minimum(self.num_relevant[:, None], cutoffs[None, :])]
+        ndcg = np.divide(dcg, idcg, out=np.zeros(dcg.shape), where=idcg > 0)
+
+        # interpolated precision, with the float operations of Score
+        query_rows, ranks = np.nonzero(self.relevance)
+        nth = rel_counts[query_rows, ranks] # the relevant document is the nth found
+        rank_precision = nth / (ranks + 1.0)
+        points = np.floor((nth * float(interp_points)) / self.num_relevant[query_rows]).astype(np.int64)
+        interpolated = np.zeros((len(cutoffs), interp_points + 1))
+        for c, cutoff in enumerate(cutoffs.tolist()):
+            kept = ranks < cutoff
+            query_points = np.zeros((num_queries, interp_points + 1))
+            np.maximum.at(query_points, (query_rows[kept], points[kept]), rank_precision[kept])
+            query_points = np.maximum.accumulate(query_points[:, ::-1], axis=1)[:, ::-1]
+            interpolated[c] = query_points.sum(axis=0) / num_queries
+
+        return {'cutoffs': cutoffs, 'precision': precision, 'recall': recall, 'fmeasure': fmeasure,
+                'map': ap.mean(axis=0), 'ndcg': ndcg.mean(axis=0), 'interpolated': interpolated}
+
+# Print the measures of several response files at several cutoffs
+def print_cutoffs(config,key):
+    print('%-30s %5s %6s %6s %6s %6s %6s' % ('response', 'k', 'P', 'R', 'F', 'MAP', 'nDCG'), file=sys.stdout)
+    for responsefile in config.responsefiles:
+        scores = Run_Matrix.from_file(key, responsefile).measures(config.cutoffs, config.interp_points)
+        for c, cutoff in enumerate(config.cutoffs):
+            print('%-30s %5d %6.3f %6.3f %6.3f %6.3f %6.3f' % (responsefile, cutoff,
+                  scores['precision'][c], scores['recall'][c], scores['fmeasure'][c],
+                  scores['map'][c], scores['ndcg'][c]), file=sys.stdout)
+            if config.show_interp_prec:
+                print('    interpolated: ' + ' '.join('%.3f' % p for p in scores['interpolated'][c]),
+                      file=sys.stdout)
+
+# Evaluate (qid, docids) results held in memory against a Key, e.g.
+# Key(Eval_Config(keyfile)) read once for many runs. Returns the Score.
+def evaluate(key, results, response_limit=None, interp_points=10):
+    config = Eval_Config(response_limit=response_limit, interp_points=interp_points)
+    return Score(config, key, Response(config, key, results))
+
 if __name__ == '__main__':
     config = CommandLine()
+    if config.cutoffs != None:
+        print_cutoffs(config, Key(config))
+        sys.exit()
     key = Key(config)
     response = Response(config,key)
     scorer = Score(config,key,response)
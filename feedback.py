@@ -0,0 +1,131 @@
+import time
+import numpy as np
+
+from forward_index import row_offsets
+
+# Rocchio pseudo-relevance feedback on top of a Retrieve object. A query
+# is run once through the Retrieve engine. Then the weights of its
+# feedback_docs best documents are read from the forward index and
+# scaled to unit length, and their centroid is added to the query
+# (scaled to unit length too):
+#     alpha * q + beta * centroid
+# Only the query terms and the expansion_terms heaviest other terms of
+# the centroid are kept. The expanded query goes through the same
+# engine for the final ranking.
+#
+# budget, in seconds, bounds the time spent on a query. The cost of the
+# second run is estimated by a least squares fit of run time against
+# postings (a + b * postings) over every run so far. Expansion terms are
+# dropped, lightest first, until the estimate fits in what is left of
+# the budget. If even the query terms do not fit, the first ranking is
+# returned. The timings of every query's stages go
+# to profile, a Query_Profile, if one is given.
+class Rocchio_Feedback:
+
+    STAGES = ('initial', 'centroid', 'expansion', 'rescoring')
+
+    def __init__(self, retrieve, feedback_docs=5, expansion_terms=40, alpha=1.0, beta=0.75,
+                 budget=None, profile=None):
+        self.retrieve = retrieve
+        self.term_weighting = retrieve.term_weighting
+        self.feedback_docs = feedback_docs
+        self.expansion_terms = expansion_terms
+        self.alpha = alpha
+        self.beta = beta
+        self.budget = budget
+        self.profile = profile
+        self.stats = {'expanded': 0, 'trimmed': 0, 'skipped': 0}
+        self.cost_sums = np.zeros(5) # runs, postings, seconds, postings^2, postings * seconds
+
+    # Mean of the unit-length weight vectors of some documents (dense
+    # doc ids), as term ids in ascending order and their weights
+    def centroid(self, docs):
+        forward_index = self.retrieve.forward_index
+        offsets, counts = row_offsets(forward_index.indptr, docs)
+        data = forward_index.data[offsets].astype(np.float64)
+        owners = np.repeat(np.arange(len(docs)), counts)
+        lengths = np.sqrt(np.bincount(owners, weights=data * data, minlength=len(docs)))
+        term_ids, inverse = np.unique(forward_index.indices[offsets], return_inverse=True)
+        weights = np.bincount(inverse.reshape(-1), weights=data / lengths[owners], minlength=len(term_ids))
+        return term_ids, weights / len(docs)
+
+    # Expanded query weights: the query terms first, in query order,
+    # then the expansion terms by descending weight
+    def expand(self, weights_query, centroid):
+        term_ids, weights = weights_query
+        centroid_ids, centroid_weights = centroid
+        length = np.sqrt(weights.dot(weights))
+        weights = self.alpha * weights / (length if length > 0 else 1)
+        positions = np.minimum(np.searchsorted(centroid_ids, term_ids), len(centroid_ids) - 1)
+        found = centroid_ids[positions] == term_ids
+        weights[found] += self.beta * centroid_weights[positions[found]]
+        others = np.ones(len(centroid_ids), dtype=bool)
+        others[positions[found]] = False
+        other_ids, other_weights = centroid_ids[others], centroid_weights[others]
+        chosen = np.lexsort((other_ids, -other_weights))[:self.expansion_terms]
+        return (np.concatenate((term_ids, other_ids[chosen])),
+                np.concatenate((weights, self.beta * other_weights[chosen])))
+
+    # Add a run of the engine to the cost fit
+    def record_cost(self, postings, seconds):
+        self.cost_sums += (1, postings, seconds, postings * postings, postings * seconds)
+
+    # Estimated run time of queries with some numbers of postings. With
+    # a single run, or runs all of the same size, time is taken to be
+    # proportional to postings.
+    def estimated_cost(self, postings):
+        runs, x, y, xx, xy = self.cost_sums
+        spread = runs * xx - x * x
+        if runs < 2 or spread <= 0:
+            return postings * (y / max(x, 1))
+        slope = max((runs * xy - x * y) / spread, 0.0)
+        return (y - slope * x) / runs + slope * postings
+
+    # Number of leading terms of the expanded query whose postings can
+    # be scored in the time left
+    def terms_in_budget(self, term_ids, time_left):
+        costs = self.estimated_cost(np.cumsum(self.retrieve.forward_index.df[term_ids]))
+        return int(np.searchsorted(costs, time_left, side='right'))
+
+    # Method performing retrieval for a single query with feedback.
+    # Returns list of doc ids for the k most relevant docs (in rank order).
+    def for_query(self, query, k=10):
+        retrieve = self.retrieve
+        timings = {}
+        query_start = time.perf_counter()
+        weights_query = retrieve.query_weights(query)
+        docs, cosines = retrieve.ranked(weights_query, max(k, self.feedback_docs))
+        timings['initial'] = time.perf_counter() - query_start
+        postings = int(retrieve.forward_index.df[weights_query[0]].sum())
+        self.record_cost(postings, timings['initial'])
+        if len(docs) == 0:
+            return self.done(query, timings, postings, [])
+        start = time.perf_counter()
+        centroid = self.centroid(docs[:self.feedback_docs])
+        timings['centroid'] = time.perf_counter() - start
+        start = time.perf_counter()
+        expanded = self.expand(weights_query, centroid)
+        if self.budget != None:
+            time_left = self.budget - (time.perf_counter() - query_start)
+            keep = self.terms_in_budget(expanded[0], time_left)
+            if keep < len(weights_query[0]):
+                self.stats['skipped'] += 1
+                timings['expansion'] = time.perf_counter() - start
+                return self.done(query, timings, postings, docs[:k])
+            if keep < len(expanded[0]):
+                self.stats['trimmed'] += 1
+                expanded = (expanded[0][:keep], expanded[1][:keep])
+        timings['expansion'] = time.perf_counter() - start
+        start = time.perf_counter()
+        docs, cosines = retrieve.ranked(expanded, k)
+        timings['rescoring'] = time.perf_counter() - start
+        self.stats['expanded'] += 1
+        expanded_postings = int(retrieve.forward_index.df[expanded[0]].sum())
+        self.record_cost(expanded_postings, timings['rescoring'])
+        return self.done(query, timings, postings + expanded_postings, docs)
+
+    # Record a query in the profile and map dense ids to doc ids
+    def done(self, query, timings, postings, docs):
+        if self.profile != None:
+            self.profile.record(query, timings, None, postings)
+        return [self.retrieve.doc_list[doc] for doc in np.asarray(docs).tolist()]
@@ -0,0 +1,119 @@
+import bisect
+import numpy as np
+
+from weighting import SCHEMES, WEIGHT_DTYPE, Weights_Builder
+
+# Offsets of the entries of some rows of a CSR matrix, row after row,
+# and the number of entries of each row
+def row_offsets(indptr, rows):
+    starts = indptr[rows]
+    counts = indptr[rows + 1] - starts
+    ends = np.cumsum(counts)
+    offsets = np.arange(int(ends[-1]) if len(ends) else 0, dtype=np.int64) + np.repeat(starts - (ends - counts), counts)
+    return offsets, counts
+
+# Transpose a doc-term CSR matrix into term-major postings: row
+# pointers, dense doc ids (ascending within each term) and weights
+def transpose(indptr, indices, data, num_terms):
+    rows = np.repeat(np.arange(len(indptr) - 1, dtype=np.int32), np.diff(indptr))
+    order = np.argsort(indices, kind='stable')
+    term_indptr = np.zeros(num_terms + 1, dtype=np.int64)
+    np.cumsum(np.bincount(indices, minlength=num_terms), out=term_indptr[1:])
+    return term_indptr, rows[order], data[order]
+
+# Term-major postings: the documents of term t (dense ids, ascending)
+# are docs[indptr[t]:indptr[t + 1]], with their weights at the same
+# offsets of data. compressed_postings.Compressed_Postings has the same
+# methods.
+class Term_Postings:
+
+    def __init__(self, indptr, docs, data):
+        self.indptr = indptr
+        self.docs = docs
+        self.data = data
+
+    # Documents and weights of some terms, term after term, and the
+    # number of postings of each
+    def gather(self, term_ids):
+        offsets, counts = row_offsets(self.indptr, term_ids)
+        return self.docs[offsets], self.data[offsets], counts
+
+    # Row pointers, doc ids and weights of every term
+    def arrays(self):
+        return self.indptr, self.docs, self.data
+
+# Compute the query weights of a scheme as arrays of term ids and
+# weights, in the order of first occurrence, dropping terms not in the
+# vocabulary, and terms whose document frequency is 0 if df is given
+def query_weights(vocabulary, term_weighting, idf, query, df=None):
+    counts = {}
+    for term in query:
+        term_id = vocabulary.term_id(term)
+        if term_id != None and (df is None or df[term_id] > 0):
+            counts[term_id] = counts.get(term_id, 0) + 1
+    term_ids = np.fromiter(counts, dtype=np.int64, count=len(counts))
+    weights = SCHEMES[term_weighting].query(
+        np.fromiter(counts.values(), dtype=np.float64, count=len(counts)), idf[term_ids])
+    return term_ids, np.asarray(weights, dtype=np.float64)
+
+# Dense ids of the terms of an index, in index order. A term is found
+# by bisection in a sorted copy of the term list, which costs a list and
+# an int32 array where a {term: id} dict would cost a hash table entry
+# and an int object per term.
+class Vocabulary:
+
+    __slots__ = ('terms', 'sorted_terms', 'sorted_ids')
+
+    def __init__(self, terms):
+        self.terms = terms
+        order = sorted(range(len(terms)), key=terms.__getitem__)
+        self.sorted_terms = [terms[term_id] for term_id in order]
+        self.sorted_ids = np.array(order, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.terms)
+
+    # Id of a term, or None if it is not in the index
+    def term_id(self, term):
+        pos = bisect.bisect_left(self.sorted_terms, term)
+        if pos < len(self.sorted_terms) and self.sorted_terms[pos] == term:
+            return int(self.sorted_ids[pos])
+        return None
+
+# Document weights of one scheme as a forward index over interned terms.
+# Document d (dense doc id, the order Retrieve breaks ties in) has the
+# term ids indices[indptr[d]:indptr[d + 1]], in ascending order, with
+# their weights at the same offsets of data. A posting costs an int32
+# and a WEIGHT_DTYPE (float32) instead of an entry in a
+# {doc: {term: weight}} dict and a float object.
+class Forward_Index:
+
+    __slots__ = ('term_weighting', 'vocabulary', 'docs', 'df', 'idf', 'norms', 'indptr', 'indices', 'data')
+
+    WEIGHT_DTYPE = WEIGHT_DTYPE
+
+    def __init__(self, index, term_weighting):
+        builder = Weights_Builder(index)
+        data, norms = builder.build([term_weighting])[term_weighting]
+        self.term_weighting = term_weighting
+        self.vocabulary = Vocabulary(builder.terms)
+        self.docs = builder.docs
+        self.df = builder.df.astype(np.int32)
+        self.idf = builder.idf
+        self.norms = norms
+        self.indptr = builder.indptr
+        self.indices = builder.indices
+        self.data = data
+
+    # Term ids and weights of one document
+    def doc_vector(self, doc):
+        row = slice(self.indptr[doc], self.indptr[doc + 1])
+        return self.indices[row], self.data[row]
+
+    # Transpose into term-major postings (see transpose)
+    def postings(self):
+        return transpose(self.indptr, self.indices, self.data, len(self.vocabulary))
+
+    # Compute query weights (see query_weights)
+    def query_weights(self, query):
+        return query_weights(self.vocabulary, self.term_weighting, self.idf, query)
@@ -0,0 +1,215 @@
+"""\
+------------------------------------------------------------
+USE: python <PROGNAME> (options) COLLECTION
+ACTION: builds inverted indexes from a collection in the
+    <document docid=N> ... </document> format, streaming it
+    document by document across a pool of worker processes,
+    and writes them to a pickle in the IR_data.pickle layout
+OPTIONS:
+    -h : print this help message
+    -s : build the "with stoplist" configuration (default: without)
+    -p : build the "with stemming" configuration (default: without)
+    -a : build all four stoplist / stemming configurations
+    -l FILE : read the stoplist from FILE (default: stop_list.txt)
+    -q FILE : also preprocess the queries in FILE (same format)
+    -j INT : use INT worker processes (default: number of CPUs)
+    -o FILE : write the indexes (and queries) to pickle FILE
+------------------------------------------------------------\
+"""
+
+import getopt
+import multiprocessing
+import os
+import pickle
+import re
+import sys
+from collections import deque
+
+DOCUMENT_START = re.compile(r'<document docid=(\d+)>')
+DOCUMENT_END = '</document>'
+WORD = re.compile('[a-z]+')
+
+# Stream (docid, text) pairs from a collection file, holding one
+# document in memory at a time
+def read_documents(collection_file):
+    with open(collection_file) as collection:
+        docid = None
+        lines = []
+        for line in collection:
+            if docid == None:
+                match = DOCUMENT_START.search(line)
+                if match:
+                    docid = int(match.group(1))
+                    lines = [line[match.end():]]
+                continue
+            end = line.find(DOCUMENT_END)
+            if end >= 0:
+                lines.append(line[:end])
+                yield docid, ''.join(lines)
+                docid = None
+            else:
+                lines.append(line)
+
+# Split text into lower case words
+def tokenise(text):
+    return WORD.findall(text.lower())
+
+# Read a stoplist file, one word per line
+def read_stoplist(stoplist_file):
+    with open(stoplist_file) as words:
+        return set(line.strip() for line in words if line.strip())
+
+# Turns tokens into index terms for a stoplist / stemming configuration.
+# Stop words are removed before stemming. Stemming uses the Porter
+# stemmer of nltk, which is only imported when it is asked for.
+class Preprocessor:
+    def __init__(self, stoplist, stemming, stop_words):
+        self.stop_words = stop_words if stoplist == 'yes' else None
+        self.stems = {}
+        if stemming == 'yes':
+            from nltk.stem import PorterStemmer
+            self.stemmer = PorterStemmer()
+        else:
+            self.stemmer = None
+
+    def terms(self, tokens):
+        if self.stop_words != None:
+            tokens = [token for token in tokens if token not in self.stop_words]
+        if self.stemmer == None:
+            return tokens
+        stems = self.stems
+        terms = []
+        for token in tokens:
+            if token not in stems:
+                stems[token] = self.stemmer.stem(token)
+            terms.append(stems[token])
+        return terms
+
+# Key of a configuration in the IR_data.pickle layout
+def choice(kind, stoplist, stemming):
+    return '%s_stoplist_%s_stemming_%s' % (kind, stoplist, stemming)
+
+#==============================================================================
+# Worker processes
+
+_preprocessors = None
+
+def _init_worker(variants, stop_words):
+    global _preprocessors
+    _preprocessors = [Preprocessor(stoplist, stemming, stop_words) for (stoplist, stemming) in variants]
+
+# Index a chunk of documents. Returns one partial index per variant,
+# {term: {docid: tf}}, with terms in order of first occurrence.
+def _index_chunk(documents):
+    partials = [{} for preprocessor in _preprocessors]
+    for (docid, text) in documents:
+        tokens = tokenise(text)
+        for (preprocessor, partial) in zip(_preprocessors, partials):
+            for term in preprocessor.terms(tokens):
+                postings = partial.get(term)
+                if postings == None:
+                    postings = partial[term] = {}
+                postings[docid] = postings.get(docid, 0) + 1
+    return partials
+
+#==============================================================================
+# Indexer
+
+class Indexer:
+
+    # Number of documents sent to a worker at a time
+    CHUNK_SIZE = 500
+
+    # variants is a list of (stoplist, stemming) pairs of 'yes' / 'no'
+    def __init__(self, variants, stop_words=frozenset(), processes=None):
+        self.variants = variants
+        self.stop_words = stop_words
+        self.processes = processes or os.cpu_count() or 1
+
+    # Group the documents of a collection into chunks
+    def chunks(self, collection_file):
+        chunk = []
+        for document in read_documents(collection_file):
+            chunk.append(document)
+            if len(chunk) == self.CHUNK_SIZE:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    # Build the indexes of every variant. Chunks are indexed in parallel
+    # with at most two chunks per worker in flight, so the raw text held
+    # in memory is bounded; partial indexes are merged in collection
+    # order, so term and posting order are the same as for a sequential
+    # build. Returns {index_stoplist_*_stemming_*: index}.
+    def index_collection(self, collection_file):
+        indexes = [{} for variant in self.variants]
+        with multiprocessing.Pool(self.processes, _init_worker, (self.variants, self.stop_words)) as pool:
+            pending = deque()
+            for chunk in self.chunks(collection_file):
+                pending.append(pool.apply_async(_index_chunk, (chunk,)))
+                if len(pending) >= 2 * self.processes:
+                    self.merge(indexes, pending.popleft().get())
+            while pending:
+                self.merge(indexes, pending.popleft().get())
+        return {choice('index', stoplist, stemming): index
+                for ((stoplist, stemming), index) in zip(self.variants, indexes)}
+
+    # Fold partial indexes into the indexes being built
+    def merge(self, indexes, partials):
+        for (index, partial) in zip(indexes, partials):
+            for term in partial:
+                postings = index.get(term)
+                if postings == None:
+                    index[term] = partial[term]
+                else:
+                    postings.update(partial[term])
+
+    # Preprocess queries the same way as the documents. Returns
+    # {queries_stoplist_*_stemming_*: [(qid, terms)]}.
+    def preprocess_queries(self, queries_file):
+        all_queries = {}
+        for (stoplist, stemming) in self.variants:
+            preprocessor = Preprocessor(stoplist, stemming, self.stop_words)
+            all_queries[choice('queries', stoplist, stemming)] = [
+                (qid, preprocessor.terms(tokenise(text))) for (qid, text) in read_documents(queries_file)]
+        return all_queries
+
+#==============================================================================
+# Command line processing
+
+def print_help():
+    progname = sys.argv[0]
+    progname = progname.split('/')[-1] # strip off extended path
+    help = __doc__.replace('<PROGNAME>', progname, 1)
+    print(help, file=sys.stderr)
+
+if __name__ == '__main__':
+    opts, args = getopt.getopt(sys.argv[1:], 'hspal:q:j:o:')
+    opts = dict(opts)
+
+    if '-h' in opts or len(args) != 1 or '-o' not in opts:
+        if not '-h' in opts:
+            print("*** ERROR: must specify one collection file and an output file (opt: -o FILE) ***",
+                  file=sys.stderr)
+        print_help()
+        sys.exit(0)
+
+    if '-a' in opts:
+        variants = [(stoplist, stemming) for stemming in ('no', 'yes') for stoplist in ('no', 'yes')]
+    else:
+        variants = [('yes' if '-s' in opts else 'no', 'yes' if '-p' in opts else 'no')]
+
+    if any(stoplist == 'yes' for (stoplist, stemming) in variants):
+        stop_words = read_stoplist(opts.get('-l', 'stop_list.txt'))
+    else:
+        stop_words = frozenset()
+
+    processes = int(opts['-j']) if '-j' in opts else None
+    indexer = Indexer(variants, stop_words, processes)
+    all_data = indexer.index_collection(args[0])
+    if '-q' in opts:
+        all_data.update(indexer.preprocess_queries(opts['-q']))
+
+    with open(opts['-o'], 'wb') as data_out:
+        pickle.dump(all_data, data_out)
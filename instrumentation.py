@@ -0,0 +1,66 @@
+import sys
+import numpy as np
+
+# Per-query measurements of Retrieve.for_query. Attach a Query_Profile
+# with Retrieve.profiled(); each query then adds a record holding the
+# wall time of every stage in seconds, the number of candidate documents
+# scored (None when the engine has no candidate set) and the number of
+# postings touched. Other retrievers record their own stages the same
+# way (see Rocchio_Feedback). A callback, if given, is called with every
+# record as it is made.
+class Query_Profile:
+
+    STAGES = ('weighting', 'relevant_docs', 'scoring', 'top_k')
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.records = []
+
+    def record(self, query, timings, candidates, postings):
+        record = {'query': query, 'timings': timings, 'candidates': candidates, 'postings': postings}
+        self.records.append(record)
+        if self.callback != None:
+            self.callback(record)
+
+    # Values of one measure over all records: a stage name, 'total',
+    # 'candidates' or 'postings'
+    def values(self, measure):
+        if measure in ('candidates', 'postings'):
+            return np.array([record[measure] for record in self.records if record[measure] != None],
+                            dtype=np.float64)
+        if measure == 'total':
+            return np.array([sum(record['timings'].values()) for record in self.records])
+        return np.array([record['timings'].get(measure, 0.0) for record in self.records])
+
+    # Histogram of a measure over log-spaced bins. Returns (counts, edges).
+    def histogram(self, measure, bins=10):
+        values = self.values(measure)
+        positive = values[values > 0]
+        if len(positive) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        low, high = positive.min(), positive.max()
+        edges = np.geomspace(low, high * (1 + 1e-9), bins + 1) if high > low else np.array([low, high * 2])
+        counts, edges = np.histogram(np.clip(values, low, None), edges)
+        return counts, edges
+
+    # Print a text histogram of the time of each stage (in ms) and of
+    # the candidate and postings counts
+    def dump(self, out=sys.stderr, bins=10, width=40):
+        print("%d queries profiled" % len(self.records), file=out)
+        seen = {}
+        for record in self.records:
+            seen.update(dict.fromkeys(record['timings']))
+        stages = [stage for stage in self.STAGES if stage in seen] + [stage for stage in seen if stage not in self.STAGES]
+        for measure in stages + ['total', 'candidates', 'postings']:
+            counts, edges = self.histogram(measure, bins)
+            scale = 1000 if measure not in ('candidates', 'postings') else 1
+            unit = 'ms' if scale == 1000 else ''
+            values = self.values(measure) * scale
+            if len(values) == 0:
+                continue
+            print("%s: p50 %.3f%s  p95 %.3f%s  max %.3f%s" % (measure, np.percentile(values, 50), unit,
+                  np.percentile(values, 95), unit, values.max(), unit), file=out)
+            most = max(counts.max(), 1) if len(counts) else 1
+            for count, low, high in zip(counts, edges[:-1] * scale, edges[1:] * scale):
+                print("  %10.3f - %10.3f %s %5d %s" % (low, high, unit.ljust(2), count,
+                      '#' * int(round(width * count / most))), file=out)
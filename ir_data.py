@@ -0,0 +1,99 @@
+"""\
+------------------------------------------------------------
+USE: python <PROGNAME> (options) PICKLE_FILE CONTAINER_FILE
+ACTION: converts the data pickle (e.g. IR_data.pickle) into a
+    container with one section per index / query set, so that
+    a run only reads the configuration it needs
+OPTIONS:
+    -h : print this help message
+------------------------------------------------------------\
+"""
+
+import getopt
+import json
+import pickle
+import struct
+import sys
+
+# A container file starts with MAGIC and the length of a JSON header
+# mapping each section name (e.g. index_stoplist_no_stemming_yes) to
+# the offset and length of its pickle, counted from the end of the
+# header. The sections follow the header.
+MAGIC = b'IRDATA1\n'
+HEADER_LENGTH = struct.Struct('<Q')
+
+# Convert a data pickle into a container file
+def convert(pickle_file, container_file):
+    with open(pickle_file, 'rb') as data_in:
+        all_data = pickle.load(data_in)
+    sections = {}
+    blobs = []
+    offset = 0
+    for name in all_data:
+        blob = pickle.dumps(all_data[name], protocol=pickle.HIGHEST_PROTOCOL)
+        sections[name] = (offset, len(blob))
+        blobs.append(blob)
+        offset += len(blob)
+    header = json.dumps(sections).encode('utf-8')
+    with open(container_file, 'wb') as out:
+        out.write(MAGIC)
+        out.write(HEADER_LENGTH.pack(len(header)))
+        out.write(header)
+        for blob in blobs:
+            out.write(blob)
+
+# Read a container's section table. Returns (sections, data start),
+# or None if the file is not a container.
+def read_header(data_in):
+    if data_in.read(len(MAGIC)) != MAGIC:
+        return None
+    (length,) = HEADER_LENGTH.unpack(data_in.read(HEADER_LENGTH.size))
+    sections = json.loads(data_in.read(length).decode('utf-8'))
+    return sections, data_in.tell()
+
+# Load the index and queries of one stoplist / stemming configuration.
+# A container is read section by section; anything else is taken to
+# be the original pickle holding every configuration.
+def load(data_file, stoplist, stemming):
+    index_name = 'index_stoplist_%s_stemming_%s' % (stoplist, stemming)
+    queries_name = 'queries_stoplist_%s_stemming_%s' % (stoplist, stemming)
+    with open(data_file, 'rb') as data_in:
+        header = read_header(data_in)
+        if header == None:
+            data_in.seek(0)
+            all_data = pickle.load(data_in)
+            return all_data[index_name], all_data[queries_name]
+        sections, start = header
+        loaded = []
+        for name in (index_name, queries_name):
+            offset, length = sections[name]
+            data_in.seek(start + offset)
+            loaded.append(pickle.loads(data_in.read(length)))
+        return loaded[0], loaded[1]
+
+# Load every section of a data file in one read, as the dict of the
+# original pickle
+def load_all(data_file):
+    with open(data_file, 'rb') as data_in:
+        header = read_header(data_in)
+        if header == None:
+            data_in.seek(0)
+            return pickle.load(data_in)
+        sections, start = header
+        data = data_in.read()
+        return {name: pickle.loads(data[offset:offset + length])
+                for name, (offset, length) in sections.items()}
+
+def print_help():
+    progname = sys.argv[0]
+    progname = progname.split('/')[-1] # strip off extended path
+    help = __doc__.replace('<PROGNAME>', progname, 1)
+    print(help, file=sys.stderr)
+
+if __name__ == '__main__':
+    opts, args = getopt.getopt(sys.argv[1:], 'h')
+    opts = dict(opts)
+    if '-h' in opts or len(args) != 2:
+        print_help()
+        sys.exit(0)
+    convert(args[0], args[1])
@@ -0,0 +1,229 @@
+"""\
+------------------------------------------------------------
+USE: python <PROGNAME> (options)
+ACTION: loads one configuration once and answers queries over
+    a local socket. Each request is one line of preprocessed
+    query terms separated by spaces; the reply is one line with
+    the doc ids retrieved, best first.
+OPTIONS:
+    -h : print this help message
+    -s : use "with stoplist" configuration (default: without)
+    -p : use "with stemming" configuration (default: without)
+    -w LABEL : use weighting scheme "LABEL" (any scheme registered in weighting.py, default: binary)
+    -k INT : retrieve the INT best documents for each query (default: 10)
+    -d FILE : read the index from FILE (default: IR_data.pickle)
+    -c DIR : use the precomputed weights cache in DIR
+    -r INT : keep the results of up to INT distinct queries in an LRU cache
+    -u PATH : listen on Unix socket PATH
+    -P INT : listen on TCP port INT of localhost (default: 8765)
+------------------------------------------------------------\
+"""
+
+import asyncio
+import concurrent.futures
+import getopt
+import os
+import sys
+
+import ir_data
+from my_retriever import Retrieve
+from sparse_index import Sparse_Index
+from weights_cache import Weights_Cache
+from query_cache import Query_Cache
+from weighting import SCHEMES
+
+DATA_FILE = 'IR_data.pickle'
+
+#==============================================================================
+# Command line processing
+
+class CommandLine:
+    def __init__(self):
+        opts, args = getopt.getopt(sys.argv[1:], 'hspw:k:d:c:r:u:P:')
+        opts = dict(opts)
+        self.exit = True
+
+        if '-h' in opts or len(args) > 0:
+            self.print_help()
+            return
+
+        self.term_weighting = opts.get('-w', 'binary')
+        if self.term_weighting not in SCHEMES:
+            print("*** ERROR: term weighting label (opt: -w LABEL) must be one of: %s ***" % ' / '.join(SCHEMES),
+                  file=sys.stderr)
+            self.print_help()
+            return
+
+        self.k = 10
+        if '-k' in opts:
+            if opts['-k'].isdigit() and int(opts['-k']) > 0:
+                self.k = int(opts['-k'])
+            else:
+                print("*** ERROR: number of results (opt: -k INT) must be a positive integer! ***",
+                      file=sys.stderr)
+                self.print_help()
+                return
+
+        self.result_cache = None
+        if '-r' in opts:
+            if opts['-r'].isdigit() and int(opts['-r']) > 0:
+                self.result_cache = int(opts['-r'])
+            else:
+                print("*** ERROR: result cache size (opt: -r INT) must be a positive integer! ***",
+                      file=sys.stderr)
+                self.print_help()
+                return
+
+        self.port = 8765
+        if '-P' in opts:
+            if opts['-P'].isdigit() and 0 < int(opts['-P']) < 65536:
+                self.port = int(opts['-P'])
+            else:
+                print("*** ERROR: port (opt: -P INT) must be an integer from 1 to 65535! ***",
+                      file=sys.stderr)
+                self.print_help()
+                return
+
+        self.stoplist = 'yes' if '-s' in opts else 'no'
+        self.stemming = 'yes' if '-p' in opts else 'no'
+        self.data_file = opts.get('-d', DATA_FILE)
+        self.cache_dir = opts.get('-c')
+        self.socket_path = opts.get('-u')
+        self.exit = False
+
+    def print_help(self):
+        progname = sys.argv[0]
+        progname = progname.split('/')[-1] # strip off extended path
+        help = __doc__.replace('<PROGNAME>', progname, 1)
+        print(help, file=sys.stderr)
+
+# Load the index of a configuration as a Sparse_Index, from the weights
+# cache when there is one
+def load_sparse_index(config):
+    cache = None
+    if config.cache_dir != None:
+        cache = Weights_Cache(config.cache_dir, config.data_file)
+        cached = cache.load(config.stoplist, config.stemming, config.term_weighting)
+        if cached != None:
+            return cached[0]
+    index, queries = ir_data.load(config.data_file, config.stoplist, config.stemming)
+    sparse_index = Sparse_Index(Retrieve(index, config.term_weighting))
+    if cache != None:
+        cache.store(config.stoplist, config.stemming, config.term_weighting, sparse_index, queries)
+    return sparse_index
+
+#==============================================================================
+# Server
+
+# Answers queries from a warm Sparse_Index. Requests that arrive while
+# a batch is being scored, or within BATCH_WINDOW seconds of the first
+# request of a batch, are scored together in one for_queries call.
+# Scoring runs on a single worker thread so that the event loop keeps
+# serving connections meanwhile. With a result cache, repeated queries
+# are answered without entering a batch.
+class Query_Server:
+
+    BATCH_WINDOW = 0.002
+    MAX_BATCH = 256
+
+    def __init__(self, sparse_index, k=10, cache=None):
+        self.sparse_index = sparse_index
+        self.k = k
+        self.cache = cache
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+
+    # Queue a query and wait for its doc ids
+    async def for_query(self, query):
+        if self.cache != None:
+            docids = self.cache.get(query, self.k)
+            if docids != None:
+                return docids
+        future = asyncio.get_running_loop().create_future()
+        await self.pending.put((query, future))
+        docids = await future
+        if self.cache != None:
+            self.cache.put(query, self.k, docids)
+        return docids
+
+    # Collect requests into batches and score each batch in one pass
+    async def batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.pending.get()]
+            deadline = loop.time() + self.BATCH_WINDOW
+            while len(batch) < self.MAX_BATCH:
+                timeout = deadline - loop.time()
+                if timeout <= 0 and self.pending.empty():
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.pending.get(), max(timeout, 0)))
+                except asyncio.TimeoutError:
+                    break
+            queries = [query for (query, future) in batch]
+            try:
+                results = await loop.run_in_executor(self.executor, self.sparse_index.for_queries, queries, self.k)
+            except Exception as error:
+                for (query, future) in batch:
+                    if not future.cancelled():
+                        future.set_exception(error)
+                continue
+            for ((query, future), docids) in zip(batch, results):
+                if not future.cancelled():
+                    future.set_result(docids)
+
+    # Serve one connection: a line of terms in, a line of doc ids out.
+    # A blank line, or a query that could not be scored, gets an empty
+    # line.
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                query = line.decode('utf-8', errors='replace').split()
+                docids = []
+                if query:
+                    try:
+                        docids = await self.for_query(query)
+                    except Exception as error:
+                        print("*** ERROR: query %r failed: %s ***" % (' '.join(query), error), file=sys.stderr)
+                writer.write((' '.join(str(docid) for docid in docids) + '\n').encode('utf-8'))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path=None, port=8765):
+        self.pending = asyncio.Queue()
+        batcher = asyncio.create_task(self.batcher())
+        if socket_path != None:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            server = await asyncio.start_unix_server(self.handle, path=socket_path)
+        else:
+            server = await asyncio.start_server(self.handle, host='127.0.0.1', port=port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            self.executor.shutdown()
+
+#==============================================================================
+# MAIN
+
+if __name__ == '__main__':
+
+    config = CommandLine()
+    if config.exit:
+        sys.exit(0)
+    sparse_index = load_sparse_index(config)
+    cache = None
+    if config.result_cache != None:
+        cache = Query_Cache(sparse_index, (config.stoplist, config.stemming), config.result_cache)
+    server = Query_Server(sparse_index, config.k, cache)
+    print("*** ready ***", file=sys.stderr)
+    try:
+        asyncio.run(server.serve(config.socket_path, config.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,144 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+
+from forward_index import row_offsets
+from sparse_index import top_k_rows
+
+# Latent semantic index over the doc-term weights of a Sparse_Index.
+# A rank r truncated SVD of the length-normalised doc-term matrix
+# A ~ U S V^T is computed with a randomised range finder, using only
+# NumPy and products with the sparse matrix. Documents are embedded as
+# the rows of U S (= A V), queries are folded in as q V, and both are
+# scaled to unit length, so that scoring a batch of queries is one
+# dense matrix product of cosines. Embeddings are float32.
+#
+# Documents need not share a term with the query to be retrieved. With
+# rerank, the dense candidates are re-scored with their exact cosine in
+# the original space instead.
+class Latent_Index:
+
+    OVERSAMPLING = 10
+    POWER_ITERATIONS = 2
+    COLUMN_BLOCK = 16
+
+    # The rank is at most min(terms, documents); a larger rank is cut
+    # down to that.
+    def __init__(self, sparse_index, rank=100, seed=0):
+        self.sparse_index = sparse_index
+        term_vectors, singular_values = self.truncated_svd(rank, np.random.default_rng(seed))
+        self.rank = term_vectors.shape[1]
+        self.term_vectors = term_vectors.astype(np.float32)
+        self.singular_values = singular_values
+        self.doc_vectors = self.unit_rows(self.docs_product(term_vectors)).astype(np.float32)
+
+    # Product of a sparse matrix, given as row pointers, column ids and
+    # values, with a dense matrix x. The products of the nonzeros are
+    # summed into their rows COLUMN_BLOCK columns of x at a time, so the
+    # temporaries hold nonzeros x COLUMN_BLOCK values, not nonzeros x width.
+    def sparse_product(self, indptr, cols, data, x):
+        product = np.zeros((len(indptr) - 1, x.shape[1]))
+        for start in range(0, x.shape[1], self.COLUMN_BLOCK):
+            block = slice(start, start + self.COLUMN_BLOCK)
+            product[:, block] = np.add.reduceat(data[:, None] * x[cols, block], indptr[:-1])
+        return product
+
+    # A X for a dense matrix X with one row per term
+    def docs_product(self, x):
+        index = self.sparse_index
+        data = index.data / np.repeat(index.norms, np.diff(index.indptr))
+        return self.sparse_product(index.indptr, index.indices, data, x)
+
+    # A^T Y for a dense matrix Y with one row per document
+    def terms_product(self, y):
+        index = self.sparse_index
+        term_indptr, term_docs, term_data = index.postings.arrays()
+        data = term_data / index.norms[term_docs]
+        return self.sparse_product(term_indptr, term_docs, data, y)
+
+    # Randomised truncated SVD (Halko, Martinsson and Tropp). Returns
+    # the rank leading right singular vectors as the columns of a
+    # (terms x rank) matrix, and the singular values.
+    def truncated_svd(self, rank, rng):
+        num_terms = len(self.sparse_index.terms)
+        width = min(rank + self.OVERSAMPLING, num_terms, self.sparse_index.num_docs)
+        basis, r = np.linalg.qr(self.docs_product(rng.standard_normal((num_terms, width))))
+        for iteration in range(self.POWER_ITERATIONS):
+            term_basis, r = np.linalg.qr(self.terms_product(basis))
+            basis, r = np.linalg.qr(self.docs_product(term_basis))
+        small = self.terms_product(basis).T # basis^T A
+        u, singular_values, vt = np.linalg.svd(small, full_matrices=False)
+        return vt[:rank].T, singular_values[:rank]
+
+    # Scale rows to unit length, leaving zero rows as they are
+    def unit_rows(self, matrix):
+        lengths = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(lengths > 0, lengths, 1)
+
+    # Fold queries into the latent space. Returns unit-length float32
+    # embeddings, one row per query; a query with no known term is 0.
+    def embed_queries(self, queries):
+        q_indptr, q_indices, q_data = self.sparse_index.queries_csr(queries)
+        rows = np.repeat(np.arange(len(queries)), np.diff(q_indptr))
+        embeddings = np.zeros((len(queries), self.rank))
+        np.add.at(embeddings, rows, q_data[:, None] * self.term_vectors[q_indices])
+        return self.unit_rows(embeddings).astype(np.float32), (q_indptr, q_indices, q_data)
+
+    # Exact cosines (or impacts) of some documents for one query, given
+    # as term ids and weights, summed over the terms of each document
+    def exact_scores(self, q_indices, q_data, docs):
+        index = self.sparse_index
+        query_weights = np.zeros(len(index.terms))
+        query_weights[q_indices] = q_data
+        offsets, counts = row_offsets(index.indptr, docs)
+        products = query_weights[index.indices[offsets]] * index.data[offsets]
+        sums = np.bincount(np.repeat(np.arange(len(docs)), counts), weights=products, minlength=len(docs))
+        return sums / index.norms[docs]
+
+    # Method performing retrieval for a list of queries at once: one
+    # matrix product of query and document embeddings, then the k best
+    # documents of each row. With rerank, the rerank best dense
+    # candidates are re-scored by exact cosine and the k best kept.
+    # Returns a list of doc id lists (in rank order), one per query.
+    def for_queries(self, queries, k=10, rerank=None):
+        results = []
+        chunk_size = self.sparse_index.CHUNK_SIZE
+        for start in range(0, len(queries), chunk_size):
+            chunk = queries[start:start + chunk_size]
+            embeddings, (q_indptr, q_indices, q_data) = self.embed_queries(chunk)
+            scores = embeddings @ self.doc_vectors.T
+            scores[~embeddings.any(axis=1)] = -np.inf
+            for i, cols in enumerate(top_k_rows(scores, max(k, rerank or 0))):
+                if rerank:
+                    query = slice(q_indptr[i], q_indptr[i + 1])
+                    exact = self.exact_scores(q_indices[query], q_data[query], cols)
+                    cols = cols[np.lexsort((cols, -exact))]
+                results.append([self.sparse_index.docs[col] for col in cols[:k]])
+        return results
+
+    # Write the embeddings to a directory of .npy files, which load()
+    # opens memory-mapped. The directory is written in a temporary
+    # directory and renamed into place.
+    def save(self, directory):
+        parent = os.path.dirname(os.path.abspath(directory))
+        os.makedirs(parent, exist_ok=True)
+        tmp_path = tempfile.mkdtemp(dir=parent)
+        try:
+            for name in ('term_vectors', 'doc_vectors', 'singular_values'):
+                np.save(os.path.join(tmp_path, name + '.npy'), getattr(self, name))
+            os.rename(tmp_path, directory)
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if not os.path.exists(directory):
+                raise
+
+    # Open embeddings written by save() for the same Sparse_Index
+    @classmethod
+    def load(cls, sparse_index, directory):
+        latent_index = cls.__new__(cls)
+        latent_index.sparse_index = sparse_index
+        for name in ('term_vectors', 'doc_vectors', 'singular_values'):
+            setattr(latent_index, name, np.load(os.path.join(directory, name + '.npy'), mmap_mode='r'))
+        latent_index.rank = latent_index.term_vectors.shape[1]
+        return latent_index
@@ -1,51 +1,51 @@
-import math
+import contextlib
+import time
 import numpy as np
 
+from compressed_postings import Compressed_Postings
+from forward_index import Forward_Index, Term_Postings, row_offsets
+from sparse_index import Sparse_Index
+from weighting import SCHEMES
+
 class Retrieve:
     
+    # Scoring engines: 'doc' scores every candidate document in turn,
+    # 'taat' walks the postings of each query term into accumulators,
+    # 'maxscore' skips documents that cannot enter the top k (MaxScore)
+    ENGINES = ('doc', 'taat', 'maxscore')
+
     # Create new Retrieve object storing index and term weighting 
     # scheme. (You can extend this method, as required.)
-    def __init__(self,index, term_weighting):
-        self.index = index
+    # Document weights are kept in a Forward_Index over term ids, and
+    # transposed into term-major postings (self.postings), which every
+    # engine walks for the query terms; with compressed, their doc ids
+    # are held as compressed blocks (see compressed_postings.py). The
+    # index itself is not kept.
+    def __init__(self,index, term_weighting, engine='doc', compressed=False):
         self.term_weighting = term_weighting
-        self.num_docs = self.number_of_docs()
+        self.engine = engine
         self.SMOOTING_TERM = 0.4
 
-        if (term_weighting == 'tfidf'):
-            self.weights = self.docs_tfidfs()
-        elif (term_weighting == 'tf'):
-            self.weights = self.docs_tfs()
+        self.forward_index = Forward_Index(index, term_weighting)
+        self.doc_list = self.forward_index.docs
+        self.num_docs = len(self.doc_list)
+        self.norms = self.forward_index.norms
+        if compressed:
+            self.postings = Compressed_Postings(*self.forward_index.postings())
         else:
-            self.weights = self.docs_binary()
-        self.vectors = self.docs_vectors_len()
-    
-    # Compute number of documents
-    def number_of_docs(self):
-        self.doc_ids = set()
-        for term in self.index:
-            self.doc_ids.update(self.index[term])
-        return len(self.doc_ids)
-
-    # Find all documents with at least one word match in a query
-    # and construct tf weight dict
-    def relevant_docs_tf(self, query):
-        documents = set() # relvant docs        
-        for word in query:
-            doc_ids = self.index.get(word) # ids of all docs containg the word
-            if doc_ids != None:
-                for doc_id in doc_ids:
-                    documents.add(doc_id)        
-        return documents
-
-    # Compute documents binary weighting for each term
-    def docs_binary(self):
-        bin_dict = {} # tf dict
-        for term in self.index:
-            for doc in self.index[term]:
-                if doc not in bin_dict:
-                    bin_dict[doc] = {}
-                bin_dict[doc][term] = 1
-        return bin_dict
+            self.postings = Term_Postings(*self.forward_index.postings())
+        self.profile = None
+        if engine == 'maxscore':
+            self.sparse_index = Sparse_Index(self)
+
+    # Find all documents with at least one of the query terms from the
+    # postings of the query terms only. Returns their dense doc ids in
+    # ascending order.
+    def relevant_docs(self, term_ids):
+        docs, data, counts = self.postings.gather(term_ids)
+        matches = np.zeros(self.num_docs, dtype=bool)
+        matches[docs] = True
+        return np.flatnonzero(matches)
 
     # Find max term occurances for each document
     def max_term_frequency(self, tf):
@@ -63,112 +63,151 @@ class Retrieve:
                 tf[doc][term] = self.SMOOTING_TERM + ((1 - self.SMOOTING_TERM) * (tf[doc][term]/tf_max[doc]))
         return tf
 
-    # Compute documents log term frequencies for each term
-    def docs_tfs(self):
-        tf_dict = {} # tf dict
-        for term in self.index:
-            for doc in self.index[term]:
-                if doc not in tf_dict:
-                    tf_dict[doc] = {}
-                if self.index[term][doc] > 0:
-                    tf_dict[doc][term] = 1 + (math.log10(self.index[term][doc]))
-                else: 
-                    tf_dict[doc][term] = 0
-        return tf_dict
-
-    # Compute documents tfidfs for each term 
-    def docs_tfidfs(self):
-        tfidfs_dict = {} # tf dict
-        for term in self.index:
-            count = len(self.index.get(term))
-            idf = (math.log10(self.num_docs / count))
-            for doc in self.index[term]:
-                if doc not in tfidfs_dict:
-                    tfidfs_dict[doc] = {}
-                tf = self.index[term][doc]
-                tfidfs_dict[doc][term] = tf * idf
-        return tfidfs_dict
-    
-    # Compute documents length of vectors
-    def docs_vectors_len(self):
-        vectors = {}
-        for doc in self.weights:
-            word_vec = np.array([])
-            for term in self.weights[doc]:
-                word_vec = np.append(word_vec,self.weights[doc][term])              
-            vectors[doc] = np.linalg.norm(word_vec)
-        return vectors
-
-    # Compute query binary term frequency
-    def query_binary(self, query):
-        tf = {}
-        for term in query:
-            if term not in tf:
-                tf[term] = 1
-        return tf
-
-    # Compute query term frequency
-    def query_tf(self, query):
-        tf = {}
-        for term in query:
-            if term in tf:
-                tf[term] += 1
-            else:
-                tf[term] = 1
-        return tf
-
-    # Compute query tfidf
-    def query_tfidf(self, query):
-        query_terms = self.query_tf(query)
-        tfidf = {}
-        for term in query:
-            if self.index.get(term) != None:
-                count = len(self.index.get(term))
-                idf = (math.log10(self.num_docs / count))
-                tfidf[term] = idf * query_terms[term]
-        return tfidf  
-
     # Compute query vector length (not neccessary in this assignment)
     def query_vector(self, tfdif):
-        word_vec = np.array([])
-        for term in tfdif:
-            word_vec = np.append(word_vec, tfdif[term])              
-        vec_len = np.linalg.norm(word_vec)
-        return vec_len
-
-    # Compute cosine similarity
-    def computing_cosine(self, tfidf_query, tfidf_docs, relevant_docs):
-        cosines = {}
-        for doc in tfidf_docs:
-            if doc in relevant_docs:
-                cosines[doc] = {}
-                product = 0
-                for term in tfidf_query:
-                    if term in tfidf_docs[doc]:
-                        product += tfidf_query[term] * tfidf_docs[doc][term]
-                cosines[doc] = product / self.vectors[doc]
-        return cosines
+        word_vec = np.fromiter(tfdif.values(), dtype=np.float64, count=len(tfdif))
+        return np.linalg.norm(word_vec)
+
+    # Compute cosine similarity document-at-a-time: the rows of the
+    # relevant documents are read from the forward index and the terms
+    # they share with the query summed per document, in query term
+    # order. Returns the dense doc ids and their cosines.
+    def computing_cosine(self, weights_query, relevant_docs):
+        term_ids, weights = weights_query
+        forward_index = self.forward_index
+        query_slots = np.full(len(forward_index.vocabulary), -1, dtype=np.int64)
+        query_slots[term_ids] = np.arange(len(term_ids))
+        offsets, counts = row_offsets(forward_index.indptr, relevant_docs)
+        owners = np.repeat(np.arange(len(relevant_docs)), counts)
+        slots = query_slots[forward_index.indices[offsets]]
+        matched = np.flatnonzero(slots >= 0)
+        matched = matched[np.lexsort((slots[matched], owners[matched]))]
+        products = weights[slots[matched]] * forward_index.data[offsets[matched]]
+        sums = np.bincount(owners[matched], weights=products, minlength=len(relevant_docs))
+        if SCHEMES[self.term_weighting].cosine:
+            sums /= self.norms[relevant_docs]
+        return relevant_docs, sums
+
+    # Compute cosine similarity term-at-a-time: walk the postings of
+    # each query term once, adding into a per-document accumulator.
+    # Query weights stay np.float64, so the products are float64 as in
+    # the other engines (a Python float times float32 stays float32).
+    def accumulate_cosine(self, weights_query):
+        term_ids, weights = weights_query
+        accumulators = np.zeros(self.num_docs)
+        touched = np.zeros(self.num_docs, dtype=bool)
+        postings_docs, postings_data, counts = self.postings.gather(term_ids)
+        ends = np.cumsum(counts).tolist()
+        for start, end, weight in zip([0] + ends, ends, weights):
+            docs = postings_docs[start:end]
+            accumulators[docs] += weight * postings_data[start:end]
+            touched[docs] = True
+        docs = np.flatnonzero(touched)
+        if not SCHEMES[self.term_weighting].cosine:
+            return docs, accumulators[docs]
+        return docs, accumulators[docs] / self.norms[docs]
+
+    # Select the k best scoring documents, in descending order of
+    # cosine. Ties go to the document with the lower dense doc id.
+    # Returns their dense doc ids and cosines.
+    def top_k(self, docs, cosines, k):
+        if 0 < k < len(docs):
+            threshold = np.partition(cosines, len(docs) - k)[len(docs) - k]
+            candidates = cosines >= threshold # every document that can make the top k
+            docs, cosines = docs[candidates], cosines[candidates]
+        order = np.lexsort((docs, -cosines))[:k]
+        return docs[order], cosines[order]
+
+    # As top_k, as (doc id, cosine) pairs
+    def top_cosines(self, docs, cosines, k):
+        docs, cosines = self.top_k(docs, cosines, k)
+        return [(self.doc_list[doc], cosine) for doc, cosine in zip(docs.tolist(), cosines.tolist())]
+
+    # Run the scoring engine on query weights (as returned by
+    # query_weights). Returns the dense doc ids of the k best documents
+    # and their cosines, in rank order.
+    def ranked(self, weights_query, k=10):
+        if self.engine == 'maxscore':
+            return self.sparse_index.top_k_maxscore(weights_query, k)
+        if self.engine == 'taat':
+            docs, cosines = self.accumulate_cosine(weights_query)
+        else:
+            docs, cosines = self.computing_cosine(weights_query, self.relevant_docs(weights_query[0]))
+        return self.top_k(docs, cosines, k)
+
+    # Compute the query weights of the term weighting scheme, as arrays
+    # of term ids and weights
+    def query_weights(self, query):
+        return self.forward_index.query_weights(query)
 
     # Method performing retrieval for a single query (which is 
     # represented as a list of preprocessed terms). Returns list 
-    # of doc ids for relevant docs (in rank order).
-    def for_query(self, query):
-        relevant_docs_ids = self.relevant_docs_tf(query)
-
-        if self.term_weighting == 'tfidf':
-            weights_query = self.query_tfidf(query) # compute query tfidf weights
-        elif self.term_weighting == 'tf':
-            weights_query = self.query_tf(query) # compute query term freq weights
-        else:
-            weights_query = self.query_binary(query) # compute query binary weights
+    # of doc ids for the k most relevant docs (in rank order).
+    def for_query(self, query, k=10):
+        if self.profile != None:
+            return self.for_query_profiled(query, k)
+        if self.engine == 'maxscore':
+            return self.sparse_index.for_query_maxscore(query, k)
+
+        weights_query = self.query_weights(query)
         
-        cosines = self.computing_cosine(weights_query, self.weights, relevant_docs_ids)
-        cosines = dict(sorted(cosines.items(), key=lambda item: item[1], reverse=True)) # descending order
-        cosines_items = cosines.items()
-        top_cosines = list(cosines_items)[:10] # get 10 best scoring
+        if self.engine == 'taat':
+            docs, cosines = self.accumulate_cosine(weights_query)
+        else:
+            relevant_docs_ids = self.relevant_docs(weights_query[0])
+            docs, cosines = self.computing_cosine(weights_query, relevant_docs_ids)
+        top_cosines = self.top_cosines(docs, cosines, k) # get k best scoring
 
         chosen_docs = []
         for tuple in top_cosines: #convert to a list of only ids
             chosen_docs.append(tuple[0])
             
-        return chosen_docs
\ No newline at end of file
+        return chosen_docs
+
+    # Record queries into a Query_Profile (see instrumentation.py) for
+    # the duration of a with block. Without one, for_query only pays
+    # for a single attribute test.
+    @contextlib.contextmanager
+    def profiled(self, profile):
+        previous = self.profile
+        self.profile = profile
+        try:
+            yield profile
+        finally:
+            self.profile = previous
+
+    # for_query, timing each stage and counting the candidate documents
+    # and the postings of the query terms. MaxScore runs as one stage;
+    # its postings are those it scored and it has no candidate set.
+    def for_query_profiled(self, query, k=10):
+        timings = {}
+        if self.engine == 'maxscore':
+            stats = self.sparse_index.pruning_stats
+            scored = stats['scored']
+            start = time.perf_counter()
+            chosen_docs = self.sparse_index.for_query_maxscore(query, k)
+            timings['maxscore'] = time.perf_counter() - start
+            self.profile.record(query, timings, None, stats['scored'] - scored)
+            return chosen_docs
+
+        start = time.perf_counter()
+        weights_query = self.query_weights(query)
+        timings['weighting'] = time.perf_counter() - start
+        term_ids = weights_query[0]
+        postings = int(self.forward_index.df[term_ids].sum())
+        if self.engine == 'taat':
+            start = time.perf_counter()
+            docs, cosines = self.accumulate_cosine(weights_query)
+            timings['scoring'] = time.perf_counter() - start
+        else:
+            start = time.perf_counter()
+            relevant_docs_ids = self.relevant_docs(term_ids)
+            timings['relevant_docs'] = time.perf_counter() - start
+            start = time.perf_counter()
+            docs, cosines = self.computing_cosine(weights_query, relevant_docs_ids)
+            timings['scoring'] = time.perf_counter() - start
+        start = time.perf_counter()
+        chosen_docs = [doc for (doc, cosine) in self.top_cosines(docs, cosines, k)]
+        timings['top_k'] = time.perf_counter() - start
+        self.profile.record(query, timings, len(docs), postings)
+        return chosen_docs
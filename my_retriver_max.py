@@ -1,6 +1,8 @@
 import math
 import numpy as np
 
+from weighting import row_norms
+
 class Retrieve:
     
     # Create new Retrieve object storing index and term weighting 
@@ -19,7 +21,8 @@ class Retrieve:
             self.weights = self.docs_max_tfs(tf, max_tf)
         else:
             self.weights = self.docs_binary()
-        self.vectors = self.docs_vectors_len()
+        self.norms = self.docs_vectors_len()
+        self.doc_positions = self.docs_positions()
     
     # Compute number of documents
     def number_of_docs(self):
@@ -78,16 +81,23 @@ class Retrieve:
                 tfidfsDict[doc][term] = tf * idf
         return tfidfsDict
     
-    # Compute documents length of vectors
+    # Compute documents length of vectors from one flat array holding
+    # the weights of all documents (see weighting.row_norms). Returns an
+    # array of norms indexed by dense doc id (the position of the doc in
+    # self.weights).
     def docs_vectors_len(self):
-        vectors = {}
-        for doc in self.weights:
-            wordVec = np.array([])
-            for term in self.weights[doc]:
-                wordVec = np.append(wordVec,self.weights[doc][term])              
-            vecLen = np.linalg.norm(wordVec)
-            vectors[doc] = vecLen
-        return vectors
+        self.doc_list = list(self.weights)
+        lengths = np.fromiter((len(self.weights[doc]) for doc in self.doc_list),
+                              dtype=np.int64, count=len(self.doc_list))
+        values = np.fromiter((weight for doc in self.doc_list for weight in self.weights[doc].values()),
+                             dtype=np.float64, count=int(lengths.sum()))
+        indptr = np.zeros(len(self.doc_list) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        return row_norms(values, indptr)
+
+    # Map each document to its dense doc id, the index into self.norms
+    def docs_positions(self):
+        return {doc: pos for pos, doc in enumerate(self.doc_list)}
         
     # Find all documents with at least one word match in a query
     # and construct tf weight dict
@@ -131,11 +141,8 @@ class Retrieve:
 
     # Compute query vector length
     def query_vector(self, tfdif):
-        wordVec = np.array([])
-        for term in tfdif:
-            wordVec = np.append(wordVec, tfdif[term])              
-        vecLen = np.linalg.norm(wordVec)
-        return vecLen
+        wordVec = np.fromiter(tfdif.values(), dtype=np.float64, count=len(tfdif))
+        return np.linalg.norm(wordVec)
 
     # Compute cosine similarity
     def computing_cosine(self, tfidfQ, tfidfD, relevantDocs):
@@ -147,7 +154,7 @@ class Retrieve:
                 for term in tfidfQ:
                     if term in tfidfD[doc]:
                         product += tfidfQ[term] * tfidfD[doc][term]
-                cosines[doc] = product / self.vectors[doc]
+                cosines[doc] = product / self.norms[self.doc_positions[doc]]
         return cosines
 
     # Method performing retrieval for a single query (which is 
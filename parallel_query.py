@@ -0,0 +1,91 @@
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+
+from sparse_index import Sparse_Index
+
+# The arrays of a Sparse_Index placed in shared memory blocks, one per
+# array, so that worker processes map them instead of receiving a
+# pickled copy. The vocabulary and doc ids go in flat arrays too (the
+# terms as one UTF-8 blob with offsets). spec() describes the blocks
+# and attach() rebuilds a Sparse_Index over them in another process.
+class Shared_Index:
+
+    def __init__(self, sparse_index):
+        self.blocks = []
+        self.layout = {}
+        arrays = dict(sparse_index.arrays())
+        encoded = [term.encode('utf-8') for term in sparse_index.terms]
+        arrays['term_text'] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        arrays['term_offsets'] = np.cumsum([0] + [len(term) for term in encoded], dtype=np.int64)
+        arrays['docs'] = np.array(sparse_index.docs, dtype=np.int64)
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            self.blocks.append(block)
+            self.layout[name] = (block.name, array.dtype.str, array.shape)
+        self.term_weighting = sparse_index.term_weighting
+
+    def spec(self):
+        return (self.term_weighting, self.layout)
+
+    # Release the shared memory; call once every worker is done
+    def unlink(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+# Build a Sparse_Index over shared memory blocks described by a spec,
+# in a process started by the creator (it shares the creator's resource
+# tracker, so the blocks are only unlinked by Shared_Index.unlink).
+# Returns (sparse_index, blocks); the blocks must stay open as long as
+# the index is used.
+def attach(spec):
+    term_weighting, layout = spec
+    blocks = []
+    arrays = {}
+    for name, (block_name, dtype, shape) in layout.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    text = arrays['term_text'].tobytes()
+    offsets = arrays['term_offsets'].tolist()
+    terms = [text[start:end].decode('utf-8') for start, end in zip(offsets, offsets[1:])]
+    docs = arrays['docs'].tolist()
+    return Sparse_Index.from_arrays(term_weighting, terms, docs, arrays), blocks
+
+#==============================================================================
+# Worker processes
+
+_sparse_index = None
+_blocks = None
+
+def _init_worker(spec):
+    global _sparse_index, _blocks
+    _sparse_index, _blocks = attach(spec)
+
+def _score_chunk(args):
+    queries, k = args
+    return _sparse_index.for_queries(queries, k)
+
+# Score (qid, query) pairs on a pool of processes sharing one index.
+# Queries are cut into chunks, CHUNKS_PER_PROCESS per process, scored
+# in batch mode and returned as (qid, docids) pairs in the original
+# order.
+CHUNKS_PER_PROCESS = 4
+
+def for_queries_parallel(sparse_index, queries, k=10, processes=None):
+    processes = processes or multiprocessing.cpu_count()
+    chunk_size = max(1, -(-len(queries) // (processes * CHUNKS_PER_PROCESS)))
+    chunks = [[query for (qid, query) in queries[start:start + chunk_size]]
+              for start in range(0, len(queries), chunk_size)]
+    shared_index = Shared_Index(sparse_index)
+    try:
+        with multiprocessing.Pool(processes, _init_worker, (shared_index.spec(),)) as pool:
+            chunk_results = pool.map(_score_chunk, [(chunk, k) for chunk in chunks])
+    finally:
+        shared_index.unlink()
+    results = [docids for chunk_result in chunk_results for docids in chunk_result]
+    return [(qid, docids) for ((qid, query), docids) in zip(queries, results)]
@@ -0,0 +1,69 @@
+from collections import Counter, OrderedDict
+
+# Bounded LRU cache of retrieval results. Queries are keyed by their
+# term-frequency bag, so repeats that only differ in term order share
+# an entry, together with the weighting scheme, the configuration the
+# index was built with (e.g. its stoplist / stemming variant) and k.
+# Scores of reordered queries can differ in the last bit of rounding,
+# so a cached ranking may break an exact tie differently than a fresh
+# run would.
+#
+# The cache sits in front of any object with for_query(query, k)
+# (Retrieve, Segmented_Index) and is emptied whenever the retriever's
+# generation attribute moves, so results never outlive an index update.
+class Query_Cache:
+    def __init__(self, retriever, config=(), max_entries=1024):
+        self.retriever = retriever
+        self.term_weighting = retriever.term_weighting
+        self.config = tuple(config)
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.generation = getattr(retriever, 'generation', None)
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def key(self, query, k):
+        return (tuple(sorted(Counter(query).items())), self.term_weighting, self.config, k)
+
+    # Drop every entry if the index changed since they were stored
+    def check_generation(self):
+        generation = getattr(self.retriever, 'generation', None)
+        if generation != self.generation:
+            self.generation = generation
+            if self.entries:
+                self.entries.clear()
+                self.stats['invalidations'] += 1
+
+    # Cached doc ids of a query, or None
+    def get(self, query, k=10):
+        self.check_generation()
+        key = self.key(query, k)
+        docids = self.entries.get(key)
+        if docids == None:
+            self.stats['misses'] += 1
+            return None
+        self.entries.move_to_end(key)
+        self.stats['hits'] += 1
+        return list(docids)
+
+    def put(self, query, k, docids):
+        self.check_generation()
+        key = self.key(query, k)
+        self.entries[key] = tuple(docids)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    # A result is not stored if the index changed while it was computed
+    # (e.g. by a background merge), as it may predate the change
+    def for_query(self, query, k=10):
+        docids = self.get(query, k)
+        if docids == None:
+            generation = self.generation
+            docids = self.retriever.for_query(query, k)
+            if getattr(self.retriever, 'generation', None) == generation:
+                self.put(query, k, docids)
+        return docids
+
+    def clear(self):
+        self.entries.clear()
@@ -0,0 +1,348 @@
+import json
+import os
+import pickle
+import threading
+import numpy as np
+
+from forward_index import query_weights
+from sparse_index import top_k_rows
+from weighting import SCHEMES, Weights_Builder
+
+# A segment of a Segmented_Index: an immutable slice of the collection
+# with term-major postings (for scoring) and doc-major term lists (for
+# weights, document frequencies and merging). Deletions only flip the
+# live flag of a document.
+class Segment:
+
+    # Build a segment from an index {term: {docid: tf}}. Documents get
+    # positions in the order they are first met, as in Retrieve.
+    def __init__(self, file_name, index, vocabulary):
+        self.file_name = file_name
+        self.docs = []
+        self.doc_positions = {}
+        self.postings = {}
+        for term in index:
+            positions = []
+            for doc in index[term]:
+                if doc not in self.doc_positions:
+                    self.doc_positions[doc] = len(self.docs)
+                    self.docs.append(doc)
+                positions.append(self.doc_positions[doc])
+            term_id = vocabulary.add(term)
+            self.postings[term_id] = (np.array(positions, dtype=np.int64),
+                                      np.fromiter(index[term].values(), dtype=np.float64, count=len(positions)))
+        self.live = np.ones(len(self.docs), dtype=bool)
+        self.docs_terms()
+        self.data = self.norms = None
+        self.weights_generation = None
+
+    # Build the doc-major view: term ids and tfs of every document, in
+    # term id order, at row pointers self.indptr. self.offsets maps each
+    # term id to the doc-major offsets of its postings, and
+    # self.doc_lengths holds the sum of the tfs of every document.
+    def docs_terms(self):
+        term_ids = np.array(list(self.postings), dtype=np.int64)
+        counts = np.array([len(self.postings[term_id][0]) for term_id in self.postings], dtype=np.int64)
+        rows = np.concatenate([self.postings[term_id][0] for term_id in self.postings]) if len(counts) else np.array([], dtype=np.int64)
+        tfs = np.concatenate([self.postings[term_id][1] for term_id in self.postings]) if len(counts) else np.array([])
+        order = np.lexsort((np.repeat(term_ids, counts), rows))
+        self.rows = rows[order]
+        self.term_ids = np.repeat(term_ids, counts)[order]
+        self.tfs = tfs[order]
+        self.indptr = np.zeros(len(self.docs) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.rows, minlength=len(self.docs)), out=self.indptr[1:])
+        inverse = np.empty(len(order), dtype=np.int64)
+        inverse[order] = np.arange(len(order))
+        self.offsets = dict(zip(self.postings, np.split(inverse, np.cumsum(counts)[:-1])))
+        self.doc_lengths = np.add.reduceat(self.tfs, self.indptr[:-1]) if len(self.docs) else self.tfs
+
+    # Compute the document weights of a scheme (doc-major, as self.tfs)
+    # and the document norms under the global statistics of a generation
+    # (see Segmented_Index.collection_stats). They change whenever a
+    # document is added or deleted anywhere, so they are recomputed in
+    # one vectorised pass when the generation moves.
+    def weights(self, term_weighting, stats, generation):
+        if self.weights_generation != generation:
+            builder = Weights_Builder.from_arrays(self.rows, self.term_ids, self.tfs, self.indptr, *stats)
+            self.data, self.norms = builder.build([term_weighting])[term_weighting]
+            self.weights_generation = generation
+        return self.data, self.norms
+
+    # Term ids of the document at a position
+    def doc_term_ids(self, position):
+        return self.term_ids[self.indptr[position]:self.indptr[position + 1]]
+
+    # Live postings as an index {term: {docid: tf}}, for merging
+    def live_index(self, vocabulary):
+        index = {}
+        for term_id, (positions, tfs) in sorted(self.postings.items()):
+            postings = {self.docs[position]: int(tf) for position, tf in zip(positions, tfs) if self.live[position]}
+            if postings:
+                index[vocabulary.terms[term_id]] = postings
+        return index
+
+# Term strings of all segments, numbered in order of first occurrence.
+# Unlike forward_index.Vocabulary it grows as segments are added, so it
+# is a dict; term_id looks terms up in the same way.
+class Segment_Vocabulary:
+    def __init__(self):
+        self.terms = []
+        self.term_ids = {}
+
+    # Id of a term, or None if no segment has it
+    def term_id(self, term):
+        return self.term_ids.get(term)
+
+    # Id of a term, numbering it if it is new
+    def add(self, term):
+        term_id = self.term_ids.get(term)
+        if term_id == None:
+            term_id = self.term_ids[term] = len(self.terms)
+            self.terms.append(term)
+        return term_id
+
+# An index that takes document additions and deletions without being
+# rebuilt. The collection is a base segment plus delta segments, one
+# per call to add_documents, stored as pickles of {term: {docid: tf}}
+# in a directory with a manifest listing the segments and the deleted
+# documents of each. Queries score every segment under global
+# document frequencies, collection size and average document length,
+# with any scheme registered in weighting.py, so scores are the same
+# as for a Retrieve object built from the whole live collection (ties
+# go to the older segment). merge folds all segments into a new base.
+class Segmented_Index:
+
+    MANIFEST = 'manifest.json'
+
+    # Open the index in directory, creating an empty one if needed.
+    # Starts a background merge once there are more than max_deltas
+    # delta segments.
+    def __init__(self, directory, term_weighting, max_deltas=8):
+        self.directory = directory
+        self.term_weighting = term_weighting
+        self.max_deltas = max_deltas
+        self.lock = threading.RLock()
+        self.vocabulary = Segment_Vocabulary()
+        self.segments = []
+        self.doc_segment = {} # live docid => segment
+        self.df = np.zeros(0)
+        self.num_docs = 0
+        self.total_length = 0.0 # of the live documents
+        self.generation = 0
+        self.next_segment = 0
+        self.merging = None
+        self.deleted_while_merging = None
+        os.makedirs(directory, exist_ok=True)
+        manifest_file = os.path.join(directory, self.MANIFEST)
+        if os.path.exists(manifest_file):
+            with open(manifest_file) as manifest_in:
+                manifest = json.load(manifest_in)
+            self.next_segment = manifest['next_segment']
+            for entry in manifest['segments']:
+                segment = self.load_segment(entry['file'])
+                self.attach(segment)
+                self.delete_in(segment, entry['deleted'])
+
+    # Create an index in directory whose base segment is index
+    @classmethod
+    def create(cls, directory, index, term_weighting, max_deltas=8):
+        segmented_index = cls(directory, term_weighting, max_deltas)
+        segmented_index.add_segment(index)
+        return segmented_index
+
+    #--------------------------------------------------------------------------
+    # Segment files
+
+    def load_segment(self, file_name):
+        with open(os.path.join(self.directory, file_name), 'rb') as segment_in:
+            return Segment(file_name, pickle.load(segment_in), self.vocabulary)
+
+    # Write a new segment file and build the segment from it
+    def write_segment(self, index):
+        with self.lock:
+            file_name = 'segment_%06d.pickle' % self.next_segment
+            self.next_segment += 1
+        with open(os.path.join(self.directory, file_name), 'wb') as segment_out:
+            pickle.dump(index, segment_out)
+        return Segment(file_name, index, self.vocabulary)
+
+    # Write the manifest, replacing the old one atomically
+    def write_manifest(self):
+        manifest = {'next_segment': self.next_segment, 'segments': [
+            {'file': segment.file_name,
+             'deleted': [segment.docs[position] for position in np.flatnonzero(~segment.live)]}
+            for segment in self.segments]}
+        manifest_file = os.path.join(self.directory, self.MANIFEST)
+        with open(manifest_file + '.tmp', 'w') as manifest_out:
+            json.dump(manifest, manifest_out)
+        os.replace(manifest_file + '.tmp', manifest_file)
+
+    #--------------------------------------------------------------------------
+    # Updates
+
+    # Count the documents of a new segment into the global statistics
+    def attach(self, segment):
+        self.segments.append(segment)
+        if len(self.df) < len(self.vocabulary.terms):
+            self.df = np.concatenate((self.df, np.zeros(len(self.vocabulary.terms) - len(self.df))))
+        for term_id, (positions, tfs) in segment.postings.items():
+            self.df[term_id] += len(positions)
+        for doc in segment.docs:
+            self.doc_segment[doc] = segment
+        self.num_docs += len(segment.docs)
+        self.total_length += segment.doc_lengths.sum()
+        self.generation += 1
+
+    # Mark documents of a segment as deleted
+    def delete_in(self, segment, docids):
+        for doc in docids:
+            position = segment.doc_positions[doc]
+            if not segment.live[position]:
+                continue
+            segment.live[position] = False
+            self.df[segment.doc_term_ids(position)] -= 1
+            self.num_docs -= 1
+            self.total_length -= segment.doc_lengths[position]
+            if self.doc_segment.get(doc) is segment:
+                del self.doc_segment[doc]
+        self.generation += 1
+
+    def add_segment(self, index):
+        with self.lock:
+            self.attach(self.write_segment(index))
+            self.write_manifest()
+
+    # Add documents, given as (docid, terms) pairs of preprocessed terms.
+    # A docid that is already in the index replaces the old document.
+    # Documents without terms cannot be retrieved and are skipped.
+    def add_documents(self, documents):
+        index = {}
+        docids = []
+        for (docid, terms) in documents:
+            if not terms:
+                continue
+            docids.append(docid)
+            for term in terms:
+                postings = index.setdefault(term, {})
+                postings[docid] = postings.get(docid, 0) + 1
+        if not docids:
+            return
+        with self.lock:
+            self.delete_documents(docids)
+            self.attach(self.write_segment(index))
+            self.write_manifest()
+            if len(self.segments) - 1 > self.max_deltas and self.merging == None:
+                self.merge_in_background()
+
+    # Delete documents by docid; unknown docids are ignored
+    def delete_documents(self, docids):
+        with self.lock:
+            by_segment = {}
+            for doc in docids:
+                segment = self.doc_segment.get(doc)
+                if segment != None:
+                    by_segment.setdefault(id(segment), (segment, []))[1].append(doc)
+                    if self.deleted_while_merging != None:
+                        self.deleted_while_merging.append(doc)
+            for (segment, segment_docids) in by_segment.values():
+                self.delete_in(segment, segment_docids)
+            if by_segment:
+                self.write_manifest()
+
+    #--------------------------------------------------------------------------
+    # Merging
+
+    # Fold every segment into one new base segment. Segments added and
+    # documents deleted while the merge runs are kept on top of it.
+    def merge(self):
+        with self.lock:
+            merged_segments = list(self.segments)
+            self.deleted_while_merging = []
+        index = {}
+        for segment in merged_segments:
+            for term, postings in segment.live_index(self.vocabulary).items():
+                index.setdefault(term, {}).update(postings)
+        base = self.write_segment(index)
+        with self.lock:
+            added_segments = self.segments[len(merged_segments):]
+            deleted = self.deleted_while_merging
+            self.deleted_while_merging = None
+            self.segments = []
+            self.doc_segment = {}
+            self.df = np.zeros(len(self.vocabulary.terms))
+            self.num_docs = 0
+            self.total_length = 0.0
+            for segment in [base] + added_segments:
+                live = segment.live
+                self.attach(segment)
+                segment.live = np.ones(len(segment.docs), dtype=bool)
+                self.delete_in(segment, [segment.docs[position] for position in np.flatnonzero(~live)])
+            self.delete_in(base, [doc for doc in deleted if doc in base.doc_positions])
+            self.write_manifest()
+            for segment in merged_segments:
+                os.remove(os.path.join(self.directory, segment.file_name))
+            self.merging = None
+
+    # Run merge in a background thread; queries keep using the old
+    # segments until the merged one is swapped in
+    def merge_in_background(self):
+        with self.lock:
+            self.merging = threading.Thread(target=self.merge, daemon=True)
+            self.merging.start()
+            return self.merging
+
+    #--------------------------------------------------------------------------
+    # Retrieval
+
+    # Compute global idf of every term; terms with no live document get 0
+    def terms_idf(self):
+        idf = np.zeros(len(self.df))
+        present = self.df > 0
+        idf[present] = np.log10(self.num_docs / self.df[present])
+        return idf
+
+    # Global statistics the weights depend on, in the order of the
+    # arguments of Weights_Builder.from_arrays: collection size, df and
+    # idf of every term and average document length
+    def collection_stats(self):
+        avg_doc_length = self.total_length / self.num_docs if self.num_docs else 1.0
+        return self.num_docs, self.df, self.terms_idf(), avg_doc_length
+
+    # Compute query weights as arrays of term ids and weights, as
+    # Retrieve does, dropping terms with no live document
+    def query_weights(self, query, idf):
+        return query_weights(self.vocabulary, self.term_weighting, idf, query, self.df)
+
+    # Score the documents of one segment; documents sharing no term with
+    # the query, and deleted documents, score -inf
+    def score_segment(self, segment, weights_query, stats, generation):
+        data, norms = segment.weights(self.term_weighting, stats, generation)
+        scores = np.zeros(len(segment.docs))
+        touched = np.zeros(len(segment.docs), dtype=bool)
+        term_ids, weights = weights_query
+        for term_id, weight in zip(term_ids.tolist(), weights): # float64 products, as in Retrieve
+            if term_id not in segment.offsets:
+                continue
+            positions = segment.postings[term_id][0]
+            scores[positions] += weight * data[segment.offsets[term_id]]
+            touched[positions] = True
+        touched &= segment.live
+        if SCHEMES[self.term_weighting].cosine:
+            scores[touched] /= norms[touched]
+        scores[~touched] = -np.inf
+        return scores
+
+    # Method performing retrieval for a single query across all
+    # segments. Returns list of doc ids for the k most relevant docs.
+    def for_query(self, query, k=10):
+        with self.lock:
+            segments = list(self.segments)
+            generation = self.generation
+            stats = self.collection_stats()
+            weights_query = self.query_weights(query, stats[2])
+            all_scores = [self.score_segment(segment, weights_query, stats, generation) for segment in segments]
+        if not segments:
+            return []
+        docs = [doc for segment in segments for doc in segment.docs]
+        cols = top_k_rows(np.concatenate(all_scores)[None, :], k)[0]
+        return [docs[col] for col in cols]
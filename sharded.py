@@ -0,0 +1,138 @@
+import heapq
+import multiprocessing
+
+from sparse_index import Sparse_Index
+from weighting import Collection_Stats, Weights_Builder
+
+# Split an index by document into num_shards {term: {docid: tf}} slices
+# of contiguous doc id ranges. Terms keep their order in every slice, so
+# each document's terms (and hence its vector length) come in the same
+# order as in the whole index. Slices are made one at a time, each in
+# its own pass over the index, so only one is held at once.
+def split_index(index, docs, num_shards):
+    ordered = sorted(docs)
+    shard_of = {}
+    for shard in range(num_shards):
+        for doc in ordered[shard * len(ordered) // num_shards:(shard + 1) * len(ordered) // num_shards]:
+            shard_of[doc] = shard
+    for shard in range(num_shards):
+        shard_index = {}
+        for term in index:
+            postings = {doc: tf for doc, tf in index[term].items() if shard_of[doc] == shard}
+            if postings:
+                shard_index[term] = postings
+        yield shard_index
+
+#==============================================================================
+# Shard processes
+
+# Serve one shard: build its Sparse_Index with the collection-wide
+# statistics, then answer (queries, k) requests on the connection with
+# (results, None), where results hold, for every query, its local top k
+# as (doc ids, cosines, dense ids in the whole collection). A request
+# that fails is answered with (None, error message) and the shard keeps
+# serving. None stops the shard.
+def _serve_shard(connection, index, term_weighting, collection, positions):
+    sparse_index = Sparse_Index.from_builder(Weights_Builder(index, collection), [term_weighting])[term_weighting]
+    del index
+    connection.send(len(sparse_index.docs))
+    while True:
+        request = connection.recv()
+        if request == None:
+            break
+        queries, k = request
+        try:
+            results = [(docids, cosines, [positions[doc] for doc in docids])
+                       for (docids, cosines) in sparse_index.for_queries_scored(queries, k)]
+        except Exception as error:
+            connection.send((None, '%s: %s' % (type(error).__name__, error)))
+        else:
+            connection.send((results, None))
+    connection.close()
+
+#==============================================================================
+# Coordinator
+
+# Document-partitioned index served by one local process per shard.
+# Each shard is built from its own slice of the postings, with idf and
+# length statistics of the whole collection, so every document scores
+# exactly what it scores in an unsharded index. A query is sent to all
+# shards at once and their top k lists are merged; ties are broken by
+# dense doc id in the whole collection, as by Retrieve, so rankings are
+# the same as those of the unsharded engines.
+class Sharded_Index:
+
+    # Seconds a shard is given to stop before it is terminated
+    STOP_TIMEOUT = 5
+
+    def __init__(self, index, term_weighting, num_shards=4):
+        self.term_weighting = term_weighting
+        collection = Collection_Stats(index)
+        positions = {doc: pos for pos, doc in enumerate(collection.docs)}
+        self.connections = []
+        self.processes = []
+        for shard_index in split_index(index, collection.docs, num_shards):
+            parent_end, child_end = multiprocessing.Pipe()
+            shard_positions = {doc: positions[doc] for postings in shard_index.values() for doc in postings}
+            process = multiprocessing.Process(target=_serve_shard, daemon=True,
+                                              args=(child_end, shard_index, term_weighting, collection,
+                                                    shard_positions))
+            process.start()
+            child_end.close()
+            del shard_index, shard_positions
+            self.connections.append(parent_end)
+            self.processes.append(process)
+        self.shard_sizes = [self.receive(shard) for shard in range(len(self.connections))]
+
+    # Receive the next message of a shard, failing if the shard died
+    def receive(self, shard):
+        try:
+            return self.connections[shard].recv()
+        except (EOFError, OSError):
+            raise RuntimeError('shard %d stopped (exit code %s)' % (shard, self.processes[shard].exitcode))
+
+    # Method performing retrieval for a list of queries at once: the
+    # queries go to every shard, which score them in parallel, and the
+    # k best of the shards' results are kept for each query. Returns a
+    # list of doc id lists (in rank order), one per query.
+    def for_queries(self, queries, k=10):
+        for shard, connection in enumerate(self.connections):
+            try:
+                connection.send((queries, k))
+            except OSError:
+                raise RuntimeError('shard %d stopped (exit code %s)' % (shard, self.processes[shard].exitcode))
+        replies = [self.receive(shard) for shard in range(len(self.connections))]
+        for shard, (results, error) in enumerate(replies):
+            if error != None:
+                raise RuntimeError('shard %d failed: %s' % (shard, error))
+        shard_results = [results for (results, error) in replies]
+        results = []
+        for per_shard in zip(*shard_results):
+            candidates = [(cosine, -position, docid) for (docids, cosines, positions) in per_shard
+                          for (docid, cosine, position) in zip(docids, cosines, positions)]
+            results.append([docid for (cosine, position, docid) in heapq.nlargest(k, candidates)])
+        return results
+
+    def for_query(self, query, k=10):
+        return self.for_queries([query], k)[0]
+
+    # Stop the shard processes, including any that already died
+    def close(self):
+        for connection, process in zip(self.connections, self.processes):
+            try:
+                connection.send(None)
+            except OSError: # the shard is gone
+                pass
+            connection.close()
+            process.join(self.STOP_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self.connections = []
+        self.processes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,252 @@
+import numpy as np
+
+from forward_index import Term_Postings, Vocabulary, query_weights, transpose
+from weighting import SCHEMES
+
+# Select the k best columns of each row of a score matrix. Columns
+# scoring -inf are not candidates. Ties are broken by column number,
+# which is the order in which computing_cosine meets the documents.
+def top_k_rows(scores, k):
+    num_cols = scores.shape[1]
+    k = min(k, num_cols)
+    if k == 0:
+        return [np.array([], dtype=np.int64) for row in scores]
+    kth = np.partition(scores, num_cols - k, axis=1)[:, num_cols - k]
+    chosen = []
+    for row, threshold in zip(scores, kth):
+        cols = np.flatnonzero(row >= threshold) # every column that can make the top k
+        cols = cols[np.argsort(-row[cols], kind='stable')][:k]
+        chosen.append(cols[row[cols] > -np.inf])
+    return chosen
+
+class Sparse_Index:
+
+    # Number of queries scored by one matrix product in for_queries
+    CHUNK_SIZE = 256
+
+    # Relative slack on MaxScore upper bounds, covering the rounding
+    # difference between a bound and the cosine it bounds
+    BOUND_SLACK = 1e-9
+
+    # Array attributes, i.e. everything derived from the index; the
+    # term-major ones are those of self.postings
+    ARRAYS = ('idf', 'norms', 'indptr', 'indices', 'data', 'term_indptr', 'term_docs', 'term_data')
+    TERM_ARRAYS = ('term_indptr', 'term_docs', 'term_data')
+
+    # Share the forward index of a Retrieve object as a compressed sparse
+    # row matrix. Documents keep the dense ids of the Retrieve object,
+    # terms its term ids (their order in the index) and vocabulary.
+    def __init__(self, retrieve):
+        forward_index = retrieve.forward_index
+        self.term_weighting = retrieve.term_weighting
+        self.docs = forward_index.docs
+        self.vocabulary = forward_index.vocabulary
+        self.terms = self.vocabulary.terms
+        self.num_docs = len(self.docs)
+        self.idf = forward_index.idf
+        self.norms = forward_index.norms
+        self.indptr, self.indices, self.data = forward_index.indptr, forward_index.indices, forward_index.data
+        self.postings = retrieve.postings
+        self.max_impacts = None
+        self.pruning_stats = {'scored': 0, 'skipped': 0}
+
+    # Build a Sparse_Index straight from its arrays (see arrays), e.g.
+    # memory-mapped from a Weights_Cache, without a Retrieve object. The
+    # term-major arrays are derived from the doc-term matrix if missing.
+    # A Vocabulary of terms can be given to share it between indexes.
+    @classmethod
+    def from_arrays(cls, term_weighting, terms, docs, arrays, vocabulary=None):
+        sparse_index = cls.__new__(cls)
+        sparse_index.term_weighting = term_weighting
+        sparse_index.docs = docs
+        sparse_index.vocabulary = vocabulary if vocabulary != None else Vocabulary(terms)
+        sparse_index.terms = terms
+        sparse_index.num_docs = len(docs)
+        for name in cls.ARRAYS:
+            if name in arrays and name not in cls.TERM_ARRAYS:
+                setattr(sparse_index, name, arrays[name])
+        if 'term_indptr' in arrays:
+            sparse_index.postings = Term_Postings(*[arrays[name] for name in cls.TERM_ARRAYS])
+        else:
+            sparse_index.postings = Term_Postings(*sparse_index.terms_csr())
+        sparse_index.max_impacts = None
+        sparse_index.pruning_stats = {'scored': 0, 'skipped': 0}
+        return sparse_index
+
+    # Build one Sparse_Index per scheme from the scan of a
+    # weighting.Weights_Builder. Returns {scheme: Sparse_Index}; the
+    # indexes share the doc-term structure and the vocabulary.
+    @classmethod
+    def from_builder(cls, builder, schemes):
+        vocabulary = Vocabulary(builder.terms)
+        sparse_indexes = {}
+        for scheme, (data, norms) in builder.build(schemes).items():
+            arrays = {'idf': builder.idf, 'norms': norms, 'indptr': builder.indptr,
+                      'indices': builder.indices, 'data': data}
+            sparse_indexes[scheme] = cls.from_arrays(scheme, builder.terms, builder.docs, arrays, vocabulary)
+        return sparse_indexes
+
+    # Map the name of every array attribute to the array
+    def arrays(self):
+        arrays = {name: getattr(self, name) for name in self.ARRAYS if name not in self.TERM_ARRAYS}
+        arrays.update(zip(self.TERM_ARRAYS, self.postings.arrays()))
+        return arrays
+
+    # Transpose the doc-term matrix into term-major postings, keeping
+    # the documents of each term in ascending dense id order
+    def terms_csr(self):
+        return transpose(self.indptr, self.indices, self.data, len(self.terms))
+
+    # Compute query weights as arrays of term ids and weights, as
+    # Forward_Index.query_weights does
+    def query_weights(self, query):
+        return query_weights(self.vocabulary, self.term_weighting, self.idf, query)
+
+    # Build the query-term matrix for a list of queries
+    def queries_csr(self, queries):
+        indptr = [0]
+        indices = [np.zeros(0, dtype=np.int64)]
+        data = [np.zeros(0, dtype=np.float64)]
+        for query in queries:
+            term_ids, weights = self.query_weights(query)
+            indices.append(term_ids)
+            data.append(weights)
+            indptr.append(indptr[-1] + len(term_ids))
+        return np.array(indptr, dtype=np.int64), np.concatenate(indices), np.concatenate(data)
+
+    # Multiply a query-term matrix by the transposed doc-term matrix.
+    # Each query entry is expanded into its term's postings and the
+    # products are summed per (query, document) cell, in query term
+    # order, so the cosines match Retrieve.computing_cosine exactly.
+    # Documents sharing no term with a query score -inf.
+    def score_matrix(self, q_indptr, q_indices, q_data):
+        num_queries = len(q_indptr) - 1
+        term_docs, term_data, counts = self.postings.gather(q_indices)
+        rows = np.repeat(np.repeat(np.arange(num_queries), np.diff(q_indptr)), counts)
+        cells = rows * self.num_docs + term_docs
+        size = num_queries * self.num_docs
+        products = np.repeat(q_data, counts) * term_data
+        # bincount gives ints when no query has a known term
+        scores = np.bincount(cells, weights=products, minlength=size).astype(np.float64, copy=False)
+        scores = scores.reshape(num_queries, self.num_docs)
+        touched = np.zeros(size, dtype=bool)
+        touched[cells] = True
+        touched = touched.reshape(num_queries, self.num_docs)
+        if SCHEMES[self.term_weighting].cosine:
+            scores /= self.norms
+        scores[~touched] = -np.inf
+        return scores
+
+    # Method performing retrieval for a list of queries at once.
+    # Returns a list of doc id lists (in rank order), one per query.
+    def for_queries(self, queries, k=10):
+        return [docids for (docids, cosines) in self.for_queries_scored(queries, k)]
+
+    # As for_queries, returning (doc ids, cosines) pairs
+    def for_queries_scored(self, queries, k=10):
+        results = []
+        for start in range(0, len(queries), self.CHUNK_SIZE):
+            scores = self.score_matrix(*self.queries_csr(queries[start:start + self.CHUNK_SIZE]))
+            for row, cols in zip(scores, top_k_rows(scores, k)):
+                results.append(([self.docs[col] for col in cols], row[cols].tolist()))
+        return results
+
+    # Compute the largest contribution weight / norm of every term over
+    # its postings, i.e. its score upper bound for a query weight of 1
+    def terms_max_impacts(self):
+        if self.max_impacts is None:
+            term_indptr, term_docs, impacts = self.postings.arrays()
+            if SCHEMES[self.term_weighting].cosine:
+                impacts = impacts / self.norms[term_docs]
+            self.max_impacts = np.maximum.reduceat(impacts, term_indptr[:-1])
+        return self.max_impacts
+
+    # Method performing retrieval for a single query with MaxScore
+    # dynamic pruning, a postings list at a time. Query terms are
+    # ordered by score upper bound. A first threshold is the k-th best
+    # contribution of a single term. The terms whose bounds add up to
+    # less than it are non-essential: documents they alone contain are
+    # never visited. Only the essential lists are walked; the
+    # non-essential ones are probed (by binary search), largest bound
+    # first, for the documents that can still reach the threshold, which
+    # rises to the k-th best partial score after each list. The cosine of
+    # every document left is summed in query term order, so the results
+    # are exactly those of for_queries. Counts of the postings scored
+    # and skipped are added to self.pruning_stats.
+    def for_query_maxscore(self, query, k=10):
+        docs, cosines = self.top_k_maxscore(self.query_weights(query), k)
+        return [self.docs[doc] for doc in docs.tolist()]
+
+    # MaxScore retrieval for query weights given as arrays of term ids
+    # and weights. Returns the dense ids of the k best documents and their
+    # cosines, in rank order. Scores only grow with every term (weights
+    # are not negative), so a partial score is a lower bound.
+    def top_k_maxscore(self, weights_query, k=10):
+        term_ids, weights = weights_query
+        num_terms = len(term_ids)
+        if num_terms == 0 or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        norms = self.norms if SCHEMES[self.term_weighting].cosine else None # else scores are not divided
+        postings_docs, postings_data, counts = self.postings.gather(term_ids)
+        ends = np.cumsum(counts).tolist()
+        postings = [(postings_docs[start:end], postings_data[start:end]) for start, end in zip([0] + ends, ends)]
+        lengths = np.array([len(term_docs) for (term_docs, term_data) in postings])
+        term_bounds = weights * self.terms_max_impacts()[term_ids]
+        order = np.argsort(term_bounds, kind='stable') # query terms by ascending bound
+        bounds = np.cumsum(term_bounds[order]) * (1 + self.BOUND_SLACK) # of the terms order[:j + 1]
+
+        # First threshold, from the list with the largest bound that
+        # holds k documents
+        threshold = -np.inf
+        for i in order[::-1]:
+            if lengths[i] >= k:
+                term_docs, term_data = postings[i]
+                impacts = weights[i] * term_data
+                if norms is not None:
+                    impacts /= norms[term_docs]
+                threshold = np.partition(impacts, lengths[i] - k)[lengths[i] - k]
+                break
+
+        # Walk the essential lists
+        essential = int(np.searchsorted(bounds, threshold, side='left'))
+        walked = order[essential:]
+        docs, slots = np.unique(np.concatenate([postings[i][0] for i in walked]), return_inverse=True)
+        rows = np.zeros((num_terms, len(docs)))
+        rows[np.repeat(walked, lengths[walked]), slots.reshape(-1)] = np.concatenate(
+            [weights[i] * postings[i][1] for i in walked])
+        estimates = rows.sum(axis=0)
+        if norms is not None:
+            estimates /= norms[docs]
+        live = np.arange(len(docs))
+        scored = int(lengths[walked].sum())
+
+        # Probe the non-essential lists for the documents still in reach
+        probed = {}
+        for j in range(essential - 1, -1, -1):
+            if len(live) >= k:
+                threshold = max(threshold, np.partition(estimates, len(live) - k)[len(live) - k])
+            reach = estimates + bounds[j] >= threshold
+            live, estimates = live[reach], estimates[reach]
+            i = order[j]
+            term_docs, term_data = postings[i]
+            positions = np.minimum(np.searchsorted(term_docs, docs[live]), lengths[i] - 1)
+            found = term_docs[positions] == docs[live]
+            contributions = np.where(found, weights[i] * term_data[positions], 0.0)
+            probed[i] = (live, contributions)
+            estimates = estimates + (contributions / norms[docs[live]] if norms is not None else contributions)
+            scored += int(found.sum())
+
+        # Exact cosines of the documents left
+        sums = np.zeros(len(live))
+        for i in range(num_terms):
+            if i in probed:
+                probe_live, contributions = probed[i]
+                sums += contributions[np.searchsorted(probe_live, live)]
+            else:
+                sums += rows[i, live]
+        docs = docs[live]
+        cosines = sums / norms[docs] if norms is not None else sums
+        ranked = np.lexsort((docs, -cosines))[:k]
+        self.pruning_stats['scored'] += scored
+        self.pruning_stats['skipped'] += int(lengths.sum()) - scored
+        return docs[ranked], cosines[ranked]
@@ -0,0 +1,94 @@
+"""\
+------------------------------------------------------------
+USE: python <PROGNAME> (options)
+ACTION: runs every stoplist / stemming / weighting scheme
+    configuration, evaluates the results in memory against
+    the gold standard and prints one comparison table. The
+    data and gold standard files are read once; the
+    configurations are built and scored on a pool of processes.
+OPTIONS:
+    -h : print this help message
+    -d FILE : read the indexes and queries from FILE (default: IR_data.pickle)
+    -g FILE : read the gold standard from FILE (default: cacm_gold_std.txt)
+    -w LIST : only use the comma separated weighting schemes in LIST
+              (default: every scheme registered in weighting.py)
+    -k INT : retrieve the INT best documents for each query (default: 10)
+    -j INT : use INT worker processes (default: number of CPUs)
+------------------------------------------------------------\
+"""
+
+import getopt
+import multiprocessing
+import sys
+
+import ir_data
+import eval_ir
+from sparse_index import Sparse_Index
+from weighting import SCHEMES, Weights_Builder
+
+DATA_FILE = 'IR_data.pickle'
+GOLD_FILE = 'cacm_gold_std.txt'
+
+CONFIGS = [(stoplist, stemming) for stemming in ('no', 'yes') for stoplist in ('no', 'yes')]
+
+# Score the queries of one stoplist / stemming configuration under
+# every scheme. The weights of all schemes come from one scan of the
+# index and the queries are scored in batch mode. Returns
+# {scheme: [(qid, docids)]}.
+def run_config(args):
+    index, queries, schemes, k = args
+    sparse_indexes = Sparse_Index.from_builder(Weights_Builder(index), schemes)
+    query_terms = [query for (qid, query) in queries]
+    runs = {}
+    for scheme in schemes:
+        results = sparse_indexes[scheme].for_queries(query_terms, k)
+        runs[scheme] = [(qid, docids) for ((qid, query), docids) in zip(queries, results)]
+    return runs
+
+# Run and evaluate every configuration. Returns a list of
+# (stoplist, stemming, scheme, precision, recall, F-measure).
+def sweep(data_file, gold_file, schemes, k=10, processes=None):
+    all_data = ir_data.load_all(data_file)
+    key = eval_ir.Key(eval_ir.Eval_Config(keyfile=gold_file))
+    tasks = [(all_data['index_stoplist_%s_stemming_%s' % config], all_data['queries_stoplist_%s_stemming_%s' % config],
+              schemes, k) for config in CONFIGS]
+    with multiprocessing.Pool(min(processes or multiprocessing.cpu_count(), len(tasks))) as pool:
+        all_runs = pool.map(run_config, tasks)
+    table = []
+    for ((stoplist, stemming), runs) in zip(CONFIGS, all_runs):
+        for scheme in schemes:
+            table.append((stoplist, stemming, scheme) + eval_ir.evaluate(key, runs[scheme]).summary())
+    return table
+
+def print_table(table):
+    print('%-8s %-8s %-10s %9s %6s %9s' % ('stoplist', 'stemming', 'weighting', 'precision', 'recall', 'F-measure'))
+    for (stoplist, stemming, scheme, precision, recall, fmeasure) in table:
+        print('%-8s %-8s %-10s %9.3f %6.3f %9.3f' % (stoplist, stemming, scheme, precision, recall, fmeasure))
+
+#==============================================================================
+# Command line processing
+
+def print_help():
+    progname = sys.argv[0]
+    progname = progname.split('/')[-1] # strip off extended path
+    help = __doc__.replace('<PROGNAME>', progname, 1)
+    print(help, file=sys.stderr)
+
+if __name__ == '__main__':
+    opts, args = getopt.getopt(sys.argv[1:], 'hd:g:w:k:j:')
+    opts = dict(opts)
+
+    if '-h' in opts or len(args) > 0:
+        print_help()
+        sys.exit(0)
+
+    schemes = opts['-w'].split(',') if '-w' in opts else list(SCHEMES)
+    unknown = [scheme for scheme in schemes if scheme not in SCHEMES]
+    if unknown:
+        print("*** ERROR: unknown weighting scheme: %s ***" % ', '.join(unknown), file=sys.stderr)
+        print_help()
+        sys.exit(0)
+
+    processes = int(opts['-j']) if '-j' in opts else None
+    print_table(sweep(opts.get('-d', DATA_FILE), opts.get('-g', GOLD_FILE), schemes,
+                      int(opts.get('-k', 10)), processes))
@@ -0,0 +1,35 @@
+import pickle
+import pytest
+
+from my_retriever import Retrieve
+from sharded import Sharded_Index
+from sparse_index import Sparse_Index
+from weighting import SCHEMES
+
+DATA_FILE = 'IR_data.pickle'
+
+# Deep enough for near ties in the weights to show up in the rankings
+K = 100
+
+@pytest.fixture(scope='module')
+def collection():
+    with open(DATA_FILE, 'rb') as data_in:
+        data = pickle.load(data_in)
+    index = data['index_stoplist_no_stemming_no']
+    queries = [query for (qid, query) in data['queries_stoplist_no_stemming_no']]
+    return index, queries
+
+# Every engine must return the rankings of the default doc engine
+@pytest.mark.parametrize('term_weighting', sorted(SCHEMES))
+def test_engines_rank_alike(collection, term_weighting):
+    index, queries = collection
+    expected = [Retrieve(index, term_weighting).for_query(query, K) for query in queries]
+    for engine in Retrieve.ENGINES:
+        for compressed in (False, True):
+            retrieve = Retrieve(index, term_weighting, engine, compressed)
+            assert [retrieve.for_query(query, K) for query in queries] == expected, (engine, compressed)
+    for compressed in (False, True):
+        sparse_index = Sparse_Index(Retrieve(index, term_weighting, compressed=compressed))
+        assert sparse_index.for_queries(queries, K) == expected, ('batch', compressed)
+    with Sharded_Index(index, term_weighting, 3) as sharded_index:
+        assert sharded_index.for_queries(queries, K) == expected, 'sharded'
@@ -0,0 +1,188 @@
+"""\
+------------------------------------------------------------
+USE: python <PROGNAME> (options)
+ACTION: builds a tiered index with champion lists of every
+    size in a list over one configuration, runs the queries of
+    the data file on each, and prints the latency percentiles
+    and the precision / recall / F-measure (against the gold
+    standard) of each size next to those of the full index
+OPTIONS:
+    -h : print this help message
+    -s : use "with stoplist" configuration (default: without)
+    -p : use "with stemming" configuration (default: without)
+    -w LABEL : use weighting scheme "LABEL" (default: tfidf)
+    -e LABEL : fall back on scoring engine "LABEL" (default: doc)
+    -d FILE : read the index and queries from FILE (default: IR_data.pickle)
+    -g FILE : read the gold standard from FILE (default: cacm_gold_std.txt)
+    -k INT : retrieve the INT best documents for each query (default: 10)
+    -r LIST : champion list sizes, comma separated (default: 10,20,50,100,200)
+    -n INT : run the query set INT times per size (default: 5)
+------------------------------------------------------------\
+"""
+
+import getopt
+import sys
+import time
+import numpy as np
+
+import ir_data
+import eval_ir
+from forward_index import row_offsets
+from my_retriever import Retrieve
+from weighting import SCHEMES
+
+DATA_FILE = 'IR_data.pickle'
+GOLD_FILE = 'cacm_gold_std.txt'
+
+CHAMPION_SIZES = (10, 20, 50, 100, 200)
+
+# Static pruning over the forward index of a Retrieve object. The first
+# tier keeps, for every term, its champion list: the champions best of
+# its postings by weight / norm (the contribution of the posting to a
+# cosine, per unit of query weight). A query is scored exactly, from
+# the forward index, but only over the documents in the champion lists
+# of its terms. When these are fewer than k, it drops to the second
+# tier, the full postings lists, through the Retrieve engine.
+#
+# Rankings are approximate: a document outside every champion list of
+# the query never enters the first tier's results, whatever its cosine.
+# The timings of every query's stages go to profile, a Query_Profile,
+# if one is given.
+class Tiered_Index:
+
+    STAGES = ('weighting', 'champions', 'scoring', 'top_k', 'fallback')
+
+    def __init__(self, retrieve, champions=50, profile=None):
+        self.retrieve = retrieve
+        self.term_weighting = retrieve.term_weighting
+        self.champions = champions
+        self.profile = profile
+        self.stats = {'first_tier': 0, 'fallback': 0}
+        self.champion_indptr, self.champion_docs = self.champion_lists(champions)
+
+    # Row pointers and dense doc ids (ascending within each term) of the
+    # champion lists. Ties in weight / norm go to the lower dense doc id.
+    def champion_lists(self, champions):
+        retrieve = self.retrieve
+        term_indptr, term_docs, term_data = retrieve.postings.arrays()
+        num_terms = len(term_indptr) - 1
+        terms = np.repeat(np.arange(num_terms), np.diff(term_indptr))
+        impacts = term_data / retrieve.norms[term_docs]
+        order = np.lexsort((term_docs, -impacts, terms))
+        ranks = np.arange(len(order)) - term_indptr[terms]
+        kept = np.sort(order[ranks < champions]) # back to term, doc order
+        champion_indptr = np.zeros(num_terms + 1, dtype=np.int64)
+        np.cumsum(np.minimum(np.diff(term_indptr), champions), out=champion_indptr[1:])
+        return champion_indptr, term_docs[kept]
+
+    # Method performing retrieval for a single query from the first tier,
+    # or the second if the first has fewer than k documents. Returns list
+    # of doc ids for the k most relevant docs (in rank order).
+    def for_query(self, query, k=10):
+        retrieve = self.retrieve
+        timings = {}
+        start = time.perf_counter()
+        weights_query = retrieve.query_weights(query)
+        timings['weighting'] = time.perf_counter() - start
+        start = time.perf_counter()
+        offsets, counts = row_offsets(self.champion_indptr, weights_query[0])
+        candidates = np.unique(self.champion_docs[offsets])
+        timings['champions'] = time.perf_counter() - start
+        if len(candidates) >= k:
+            start = time.perf_counter()
+            docs, cosines = retrieve.computing_cosine(weights_query, candidates)
+            timings['scoring'] = time.perf_counter() - start
+            start = time.perf_counter()
+            docs, cosines = retrieve.top_k(docs, cosines, k)
+            timings['top_k'] = time.perf_counter() - start
+            self.stats['first_tier'] += 1
+        else:
+            start = time.perf_counter()
+            docs, cosines = retrieve.ranked(weights_query, k)
+            timings['fallback'] = time.perf_counter() - start
+            self.stats['fallback'] += 1
+        if self.profile != None:
+            self.profile.record(query, timings, len(candidates), int(counts.sum()))
+        return [retrieve.doc_list[doc] for doc in docs.tolist()]
+
+#==============================================================================
+# Latency / effectiveness report
+
+# Run the queries repeats times on a retriever. Returns the results of
+# the first run as [(qid, docids)] and the latency of every query run
+# in milliseconds.
+def run_queries(retriever, queries, k, repeats):
+    latencies = []
+    for repeat in range(repeats):
+        results = []
+        for (qid, query) in queries:
+            start = time.perf_counter()
+            docids = retriever.for_query(query, k)
+            latencies.append(time.perf_counter() - start)
+            results.append((qid, docids))
+        if repeat == 0:
+            first_results = results
+    return first_results, np.array(latencies) * 1000
+
+# Latency and effectiveness of the full index and of every champion
+# list size. Returns a list of (size, build seconds, p50, p95, p99,
+# precision, recall, F-measure, fraction of queries answered by the
+# second tier); size, build seconds and fraction are None for the full
+# index.
+def report(retrieve, queries, key, sizes, k=10, repeats=5):
+    rows = []
+    results, latencies = run_queries(retrieve, queries, k, repeats)
+    rows.append((None, None) + tuple(np.percentile(latencies, [50, 95, 99])) +
+                eval_ir.evaluate(key, results).summary() + (None,))
+    for size in sizes:
+        start = time.perf_counter()
+        tiered_index = Tiered_Index(retrieve, size)
+        build = time.perf_counter() - start
+        results, latencies = run_queries(tiered_index, queries, k, repeats)
+        fallback = tiered_index.stats['fallback'] / max(sum(tiered_index.stats.values()), 1)
+        rows.append((size, build) + tuple(np.percentile(latencies, [50, 95, 99])) +
+                    eval_ir.evaluate(key, results).summary() + (fallback,))
+    return rows
+
+def print_report(rows):
+    print('%-6s %7s %8s %8s %8s %9s %6s %9s %8s' % ('r', 'build', 'p50', 'p95', 'p99',
+                                                    'precision', 'recall', 'F-measure', 'fallback'))
+    for (size, build, p50, p95, p99, precision, recall, fmeasure, fallback) in rows:
+        if size == None:
+            print('%-6s %7s %6.3fms %6.3fms %6.3fms %9.3f %6.3f %9.3f %8s' % (
+                  'full', '-', p50, p95, p99, precision, recall, fmeasure, '-'))
+        else:
+            print('%-6d %6.3fs %6.3fms %6.3fms %6.3fms %9.3f %6.3f %9.3f %7.1f%%' % (
+                  size, build, p50, p95, p99, precision, recall, fmeasure, 100 * fallback))
+
+#==============================================================================
+# Command line processing
+
+def print_help():
+    progname = sys.argv[0]
+    progname = progname.split('/')[-1] # strip off extended path
+    help = __doc__.replace('<PROGNAME>', progname, 1)
+    print(help, file=sys.stderr)
+
+if __name__ == '__main__':
+    opts, args = getopt.getopt(sys.argv[1:], 'hspw:e:d:g:k:r:n:')
+    opts = dict(opts)
+
+    if '-h' in opts or len(args) > 0:
+        print_help()
+        sys.exit(0)
+
+    term_weighting = opts.get('-w', 'tfidf')
+    engine = opts.get('-e', 'doc')
+    if term_weighting not in SCHEMES or engine not in Retrieve.ENGINES:
+        print("*** ERROR: unknown weighting scheme or scoring engine ***", file=sys.stderr)
+        print_help()
+        sys.exit(0)
+
+    stoplist = 'yes' if '-s' in opts else 'no'
+    stemming = 'yes' if '-p' in opts else 'no'
+    index, queries = ir_data.load(opts.get('-d', DATA_FILE), stoplist, stemming)
+    key = eval_ir.Key(eval_ir.Eval_Config(keyfile=opts.get('-g', GOLD_FILE)))
+    sizes = [int(size) for size in opts['-r'].split(',')] if '-r' in opts else CHAMPION_SIZES
+    retrieve = Retrieve(index, term_weighting, engine)
+    print_report(report(retrieve, queries, key, sizes, int(opts.get('-k', 10)), int(opts.get('-n', 5))))
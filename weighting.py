@@ -0,0 +1,182 @@
+import math
+import numpy as np
+
+# Type of the stored document weights. A posting costs a float32 instead
+# of a float64; vector lengths are computed from the float64 weights and
+# scores are summed in float64, and every engine (Retrieve, Sparse_Index,
+# shards, segments) reads the same float32 weights, so they rank alike.
+WEIGHT_DTYPE = np.float32
+
+# Weighting schemes by name. Each scheme has a docs function turning the
+# postings arrays of a Weights_Builder into one weight per posting, and
+# a query function turning the counts of the distinct query terms and
+# their idf into query weights. Both are vectorised over NumPy arrays.
+SCHEMES = {}
+
+class Weighting_Scheme:
+    # descending_norms: the vector length of a document is summed over
+    # its weights in descending order, as my_retriver_max.py does after
+    # sorting each document by term frequency
+    # cosine: scores are divided by the vector length of the document;
+    # otherwise the document weights are final impacts and every norm
+    # is 1
+    def __init__(self, name, docs, query, descending_norms=False, cosine=True):
+        self.name = name
+        self.docs = docs
+        self.query = query
+        self.descending_norms = descending_norms
+        self.cosine = cosine
+
+def register(name, docs, query, descending_norms=False, cosine=True):
+    SCHEMES[name] = Weighting_Scheme(name, docs, query, descending_norms, cosine)
+
+# Vector length of every row of a flat array of weights, row r being
+# data[indptr[r]:indptr[r + 1]]. Each length is a dot product over a
+# view of the array, the reduction np.linalg.norm uses, so every
+# Retrieve class gets the same floats and tied documents keep their
+# order.
+def row_norms(data, indptr):
+    bounds = zip(indptr[:-1].tolist(), indptr[1:].tolist())
+    squares = np.fromiter((data[start:end].dot(data[start:end]) for start, end in bounds),
+                          dtype=np.float64, count=len(indptr) - 1)
+    return np.sqrt(squares)
+
+# 1 + log10(tf) of an array of term frequencies (0 stays 0). The logs are
+# taken with math.log10 over the distinct values, so weights are the
+# same floats as those of the dict-based Retrieve classes.
+def log_tf(tfs):
+    values, inverse = np.unique(tfs, return_inverse=True)
+    table = np.array([1 + math.log10(value) if value > 0 else 0.0 for value in values.tolist()],
+                     dtype=np.float64)
+    return table[inverse.reshape(-1)]
+
+# Smoothing term of maximum tf normalisation (my_retriver_max.py)
+SMOOTHING_TERM = 0.4
+
+register('binary', lambda postings: np.ones(len(postings.tfs)),
+         lambda counts, idf: np.ones(len(counts)))
+register('tf', lambda postings: log_tf(postings.tfs),
+         lambda counts, idf: counts)
+register('tfidf', lambda postings: postings.tfs * postings.idf[postings.indices],
+         lambda counts, idf: idf * counts)
+# tfidf of my_retriever_log.py, with log tf on both sides
+register('logtfidf', lambda postings: log_tf(postings.tfs) * postings.idf[postings.indices],
+         lambda counts, idf: idf * log_tf(counts))
+# tf of my_retriver_max.py, normalised by the largest tf of the document
+register('maxtf', lambda postings: SMOOTHING_TERM + ((1 - SMOOTHING_TERM) *
+                                   (postings.tfs / postings.doc_max_tfs[postings.rows])),
+         lambda counts, idf: counts, descending_norms=True)
+
+# Okapi BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# BM25 impact of every posting, idf and document length normalisation
+# included, so a query only sums the impacts of its terms (once per
+# occurrence of the term in the query)
+def bm25_impacts(postings):
+    idf = np.log((postings.collection_size - postings.df + 0.5) / (postings.df + 0.5) + 1)
+    lengths = postings.doc_lengths[postings.rows] / postings.avg_doc_length
+    tfs = postings.tfs
+    return idf[postings.indices] * (tfs * (BM25_K1 + 1)) / (tfs + BM25_K1 * (1 - BM25_B + BM25_B * lengths))
+
+register('bm25', bm25_impacts, lambda counts, idf: counts, cosine=False)
+
+# Statistics of a whole collection that weights depend on: the number
+# of documents, the document frequency of every term and the average
+# document length. Given to a Weights_Builder over part of the
+# collection (a shard), they make its weights those of the whole.
+class Collection_Stats:
+    def __init__(self, index):
+        self.df = {}
+        total_length = 0
+        docs = {}
+        for term in index:
+            postings = index[term]
+            self.df[term] = len(postings)
+            total_length += sum(postings.values())
+            docs.update(dict.fromkeys(postings))
+        self.docs = list(docs) # in dense id order
+        self.num_docs = len(self.docs)
+        self.avg_doc_length = total_length / self.num_docs if self.num_docs else 1.0
+
+# Computes document weights and vector lengths for any set of
+# registered schemes from a single scan of a {term: {docid: tf}} index.
+# The scan produces doc-major postings arrays (documents in the dense id
+# order of Retrieve, terms of each document in index order) that every
+# scheme then weighs in one vectorised pass. With collection, a
+# Collection_Stats of a larger collection the index is part of, idf and
+# length normalisation use the statistics of that collection.
+class Weights_Builder:
+    def __init__(self, index, collection=None):
+        self.terms = list(index)
+        posting_docs = []
+        posting_tfs = []
+        df = np.zeros(len(self.terms), dtype=np.int64)
+        for term_id, term in enumerate(self.terms):
+            postings = index[term]
+            posting_docs.extend(postings)
+            posting_tfs.extend(postings.values())
+            df[term_id] = len(postings)
+        self.docs = list(dict.fromkeys(posting_docs))
+        self.num_docs = len(self.docs)
+        positions = {doc: pos for pos, doc in enumerate(self.docs)}
+        rows = np.fromiter((positions[doc] for doc in posting_docs), dtype=np.int64, count=len(posting_docs))
+        term_ids = np.repeat(np.arange(len(self.terms), dtype=np.int32), df)
+        order = np.argsort(rows, kind='stable')
+        self.rows = rows[order]
+        self.indices = term_ids[order]
+        self.tfs = np.array(posting_tfs, dtype=np.float64)[order]
+        self.indptr = np.zeros(self.num_docs + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.rows, minlength=self.num_docs), out=self.indptr[1:])
+        if collection == None:
+            self.collection_size = self.num_docs
+            self.df = df
+            self.avg_doc_length = self.tfs.sum() / self.num_docs if self.num_docs else 1.0
+        else:
+            self.collection_size = collection.num_docs
+            self.df = np.array([collection.df[term] for term in self.terms], dtype=np.int64)
+            self.avg_doc_length = collection.avg_doc_length
+        self.idf = np.array([math.log10(self.collection_size / count) for count in self.df.tolist()],
+                            dtype=np.float64)
+        self.doc_max_tfs = np.maximum.reduceat(self.tfs, self.indptr[:-1]) if self.num_docs else self.tfs
+        self.doc_lengths = np.add.reduceat(self.tfs, self.indptr[:-1]) if self.num_docs else self.tfs
+
+    # A builder over doc-major postings arrays scanned elsewhere (rows,
+    # term ids and tfs at row pointers indptr), weighted under the given
+    # collection statistics: its size, the df and idf of every term id
+    # and its average document length. It has no terms nor docs.
+    @classmethod
+    def from_arrays(cls, rows, indices, tfs, indptr, collection_size, df, idf, avg_doc_length):
+        builder = cls.__new__(cls)
+        builder.terms = builder.docs = None
+        builder.num_docs = len(indptr) - 1
+        builder.rows, builder.indices, builder.tfs, builder.indptr = rows, indices, tfs, indptr
+        builder.collection_size = collection_size
+        builder.df = df
+        builder.idf = idf
+        builder.avg_doc_length = avg_doc_length
+        builder.doc_max_tfs = np.maximum.reduceat(tfs, indptr[:-1]) if builder.num_docs else tfs
+        builder.doc_lengths = np.add.reduceat(tfs, indptr[:-1]) if builder.num_docs else tfs
+        return builder
+
+    # Document weights of a scheme, one per posting in doc-major order
+    def data(self, scheme):
+        return SCHEMES[scheme].docs(self).astype(np.float64)
+
+    # Vector length of every document (see row_norms)
+    def norms(self, scheme, data):
+        if not SCHEMES[scheme].cosine:
+            return np.ones(self.num_docs)
+        if SCHEMES[scheme].descending_norms:
+            data = data[np.lexsort((-data, self.rows))]
+        return row_norms(data, self.indptr)
+
+    # Map each scheme to (weights, norms), all computed from this scan.
+    # Weights are stored as WEIGHT_DTYPE, norms from the float64 weights.
+    def build(self, schemes):
+        built = {}
+        for scheme in schemes:
+            data = self.data(scheme)
+            built[scheme] = (data.astype(WEIGHT_DTYPE), self.norms(scheme, data))
+        return built
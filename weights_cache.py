@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+
+from sparse_index import Sparse_Index
+
+# On-disk cache of the structures derived from the index (postings
+# arrays, weights, document norms and idf) for one data file. Entries
+# are keyed by the content hash of the data file and by the stoplist,
+# stemming and term weighting configuration. Each entry is a directory
+# of .npy files, opened memory-mapped, plus a JSON file holding the
+# vocabulary, the doc ids and the queries of the configuration.
+#
+# FORMAT_VERSION is part of the entry name and is recorded in the JSON
+# file. Bump it whenever the cached arrays change (their dtypes, or how
+# weights or norms are computed), so that stale entries are rebuilt
+# instead of being read.
+class Weights_Cache:
+
+    META_FILE = 'meta.json'
+
+    # 2: float32 weights, BM25 average length over the whole collection
+    FORMAT_VERSION = 2
+
+    def __init__(self, cache_dir, data_file):
+        self.cache_dir = cache_dir
+        self.data_hash = self.file_hash(data_file)
+
+    # Compute sha256 of the data file, read in 1MB blocks
+    def file_hash(self, data_file):
+        digest = hashlib.sha256()
+        with open(data_file, 'rb') as data_in:
+            for block in iter(lambda: data_in.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    # Directory holding the entry for one configuration
+    def entry_path(self, stoplist, stemming, term_weighting):
+        name = '%s_v%d_stoplist_%s_stemming_%s_%s' % (self.data_hash[:16], self.FORMAT_VERSION,
+                                                      stoplist, stemming, term_weighting)
+        return os.path.join(self.cache_dir, name)
+
+    # Open the entry for a configuration. Returns (sparse_index, queries),
+    # or None if the configuration has not been cached yet in this format.
+    def load(self, stoplist, stemming, term_weighting):
+        path = self.entry_path(stoplist, stemming, term_weighting)
+        meta_file = os.path.join(path, self.META_FILE)
+        if not os.path.exists(meta_file):
+            return None
+        with open(meta_file) as meta_in:
+            meta = json.load(meta_in)
+        if meta.get('version') != self.FORMAT_VERSION:
+            return None
+        arrays = {}
+        for name in Sparse_Index.ARRAYS:
+            arrays[name] = np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+        sparse_index = Sparse_Index.from_arrays(term_weighting, meta['terms'], meta['docs'], arrays)
+        queries = [(qid, query) for qid, query in meta['queries']]
+        return sparse_index, queries
+
+    # Write the entry for a configuration. The entry is built in a
+    # temporary directory and renamed into place, so concurrent runs
+    # never see a partly written entry.
+    def store(self, stoplist, stemming, term_weighting, sparse_index, queries):
+        path = self.entry_path(stoplist, stemming, term_weighting)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = tempfile.mkdtemp(dir=self.cache_dir)
+        try:
+            for name, array in sparse_index.arrays().items():
+                np.save(os.path.join(tmp_path, name + '.npy'), np.ascontiguousarray(array))
+            meta = {'version': self.FORMAT_VERSION, 'terms': sparse_index.terms, 'docs': sparse_index.docs, 'queries': queries}
+            with open(os.path.join(tmp_path, self.META_FILE), 'w') as meta_out:
+                json.dump(meta, meta_out)
+            os.rename(tmp_path, path)
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if not os.path.exists(os.path.join(path, self.META_FILE)):
+                raise